@@ -0,0 +1,98 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled version of proso.geography.elo._replay.
+"""
+
+from libc.math cimport exp
+from libc.stdlib cimport malloc, free
+
+
+cdef double NEVER_SECONDS = 315360000.0
+
+
+cdef inline double _sigmoid(double x):
+    return 1.0 / (1 + exp(-x))
+
+
+cdef double _predict(double* skills, Py_ssize_t n, double* probs):
+    # the same as proso.geography.model.predict (only the probability for
+    # the asked place)
+    cdef Py_ssize_t i, j, guess
+    cdef double asked_prob, current_prob
+    if n == 1:
+        return _sigmoid(skills[0])
+    for j in range(n):
+        probs[j] = _sigmoid(skills[j])
+    asked_prob = 0
+    for i in range(1 << n):
+        if i & 1:
+            guess = 1
+        else:
+            guess = 0
+            for j in range(n):
+                if not (i >> j) & 1:
+                    guess += 1
+        current_prob = 1
+        for j in range(n):
+            if (i >> j) & 1:
+                current_prob *= probs[j]
+            else:
+                current_prob *= 1 - probs[j]
+        asked_prob += (1.0 / guess) * current_prob
+    return asked_prob
+
+
+def replay(long long[:] users, long long[:] places, unsigned char[:] correct,
+        long long[:] offsets, long long[:] options, long long[:] sources,
+        long long[:] inserted, double[:] prior_skill, long long[:] user_answers,
+        double[:] difficulty, long long[:] place_answers, double[:] current,
+        Py_ssize_t start, int update_difficulty, double elo_alpha, double elo_alpha_dynamic,
+        double pfae_good, double pfae_bad, double time_shift):
+    cdef Py_ssize_t n = users.shape[0]
+    cdef Py_ssize_t i, k, m, source, user, first_place, max_options = 1
+    cdef double user_prior, skill, seconds, result, prior_prediction, current_prediction
+    cdef double* skills
+    cdef double* shifted
+    cdef double* probs
+    for i in range(start, n):
+        if offsets[i + 1] - offsets[i] > max_options:
+            max_options = offsets[i + 1] - offsets[i]
+    skills = <double*> malloc(max_options * sizeof(double))
+    shifted = <double*> malloc(max_options * sizeof(double))
+    probs = <double*> malloc(max_options * sizeof(double))
+    try:
+        for i in range(start, n):
+            user = users[i]
+            user_prior = prior_skill[user]
+            m = 0
+            for k in range(offsets[i], offsets[i + 1]):
+                source = sources[k]
+                if 0 <= source < i:
+                    skill = current[source]
+                    seconds = (inserted[i] - inserted[source]) * 1e-9
+                else:
+                    skill = user_prior - difficulty[options[k]]
+                    seconds = NEVER_SECONDS
+                skills[m] = skill
+                shifted[m] = skill + time_shift / (seconds if seconds > 0.001 else 0.001)
+                m += 1
+            result = correct[i]
+            prior_prediction = _predict(skills, m, probs)
+            current_prediction = _predict(shifted, m, probs)
+            first_place = options[offsets[i]]
+            prior_skill[user] = user_prior + elo_alpha / (1 + elo_alpha_dynamic * user_answers[user]) * (result - prior_prediction)
+            if update_difficulty:
+                difficulty[places[i]] = (
+                    difficulty[first_place] -
+                    elo_alpha / (1 + elo_alpha_dynamic * place_answers[first_place]) * (result - prior_prediction))
+            if correct[i]:
+                current[i] = skills[0] + pfae_good * (result - current_prediction)
+            else:
+                current[i] = skills[0] + pfae_bad * (result - current_prediction)
+            user_answers[user] += 1
+            place_answers[places[i]] += 1
+    finally:
+        free(skills)
+        free(shifted)
+        free(probs)
+
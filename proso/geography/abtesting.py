@@ -41,17 +41,15 @@ def prepare_data(data, group_prefixes):
         )
 
     data = drop_invalid_data(data)
-    data = answer.apply_filter(data, lambda d: valid_ab_values(d['ab_values']))
+    valid = decorator.ab_values_mask(data, valid_ab_values)
+    invalid_users = data['user'].values[~valid]
+    data = data[valid & ~data['user'].isin(invalid_users).values]
     if 'recommendation_by_' in group_prefixes and 'recommendation_options_' in group_prefixes:
         data = answer.apply_filter(data, lambda d: d['inserted'] < EXPERIMENT_1_FINISH)
     data = decorator.interested_ab_values(data, group_prefixes)
-    users_in_groups = (data.groupby('interested_ab_values').
-        apply(lambda x: x['user'].unique()).
-        to_dict().
-        values())
-    users_and_groups = [
-        (u, sum([u in us for us in users_in_groups]))
-        for u in data['user'].unique()
-    ]
-    invalid_users = map(lambda (u, n): u, filter(lambda (u, n): n > 1, users_and_groups))
+    groups_per_user = (data[['user', 'interested_ab_values']].
+        drop_duplicates().
+        groupby('user').
+        size())
+    invalid_users = groups_per_user[groups_per_user > 1].index.values
     return data[~data['user'].isin(invalid_users)]
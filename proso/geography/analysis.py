@@ -1,17 +1,50 @@
+from StringIO import StringIO
 from argparse import ArgumentParser
+from itertools import islice
 from os import path, makedirs
 import proso.geography.answers as answer
+import proso.geography.cache as cache
 import proso.geography.decorator as decorator
 import proso.geography.difficulty
+import proso.geography.ids as ids
+import proso.geography.session as session
 import proso.geography.user as user
 import gc
+import hashlib
+import json
+import multiprocessing
 import numpy as np
 import pandas
 import sys
 from datetime import datetime
+from time import time
 import matplotlib.pyplot as plt
 
 
+ANSWER_COLUMNS = ['id', 'user', 'user_code', 'inserted', 'place_asked', 'place_answered', 'session_number']
+
+CHECKPOINT_PARTS = ['places', 'users', 'pairs']
+
+# columns kept for all the answers when they are loaded in chunks
+COMPACT_COLUMNS = ['id', 'user', 'inserted', 'place_asked', 'place_answered']
+
+# filters evaluated on each chunk of answers when they are loaded in chunks
+PUSHDOWN_FILTERS = ['map_code', 'map_type', 'place_asked_type']
+
+# name prefix of the cached answers filtered by the prefixes of the filter
+# chain
+CHAIN_CACHE_PREFIX = 'geography.answer__chain_'
+
+# columns the pushed filters are evaluated on when the answers are loaded
+# from the partitioned dataset or queried from the HDF table
+PUSHDOWN_COLUMNS = {
+    'map_code': 'place_map_code',
+    'map_type': 'place_map_type',
+    'place_asked_type': 'place_asked_type',
+    'drop_tests': 'test_id',
+}
+
+
 def parser_init(required=None):
     parser = ArgumentParser()
     parser.add_argument(
@@ -86,7 +119,8 @@ def parser_init(required=None):
         '--storage',
         type=str,
         default='hdf',
-        choices=['csv', 'hdf', 'pkl'])
+        choices=['csv', 'hdf', 'hdf-table', 'hdf-table-blosc', 'npy', 'pkl'],
+        help='format of the cached data, "npy" memory-maps the cached columns, "hdf-table" stores them as queryable tables (optionally compressed by blosc), so the date and map filters are pushed down as queries')
     parser.add_argument(
         '--map-code',
         dest='map_code',
@@ -125,6 +159,39 @@ def parser_init(required=None):
         '--verbose',
         dest='verbose',
         action='store_true')
+    parser.add_argument(
+        '--difficulty-engine',
+        dest='difficulty_engine',
+        choices=proso.geography.difficulty.ENGINES,
+        default='array',
+        help='engine used to compute the difficulty and prior skill')
+    parser.add_argument(
+        '--difficulty-checkpoint',
+        metavar='DIR',
+        dest='difficulty_checkpoint',
+        help='destination of the previous analysis containing the checkpoint of the difficulty and prior skill, only the newer answers are replayed (array engine only)')
+    parser.add_argument(
+        '--chunk-size',
+        dest='chunk_size',
+        type=int,
+        help='parse the answers in chunks of the given number of lines and apply the date and map filters to each chunk (when all the answers are not needed)')
+    parser.add_argument(
+        '--processes',
+        dest='processes',
+        type=int,
+        help='number of processes used by the parallel computations, by default the number of CPUs')
+    parser.add_argument(
+        '--chain-cache-limit',
+        dest='chain_cache_limit',
+        type=int,
+        default=10,
+        help='maximal number of the cached answers filtered by the prefixes of the filter chain, the least recently used are removed')
+    parser.add_argument(
+        '--dataset',
+        metavar='DIR',
+        dest='dataset',
+        required=_is_required(required, '--dataset'),
+        help='path to the dataset converted from the data files (see scripts/convert.py), only its partitions matching the date limits and map codes are read')
     parser.add_argument(
         '--filter-abvalue',
         nargs='+',
@@ -140,47 +207,62 @@ def date_limit(value):
         return datetime.strptime(value, '%Y-%m-%d_%H:%M:%S')
 
 
-def write_cache(args, dataframe, filename, force_storage=None):
+def write_cache(args, dataframe, filename, force_storage=None, params=None, inputs=None):
     if not path.exists(args.destination):
         makedirs(args.destination)
-    if args.storage == 'csv' or force_storage == 'csv':
-        if not path.exists('%s/%s.csv' % (args.destination, filename)):
-            print 'writing CSV cache "%s" (%s lines)' % (filename, len(dataframe))
-            dataframe.to_csv('%s/%s.csv' % (args.destination, filename), index=False)
-    elif args.storage == 'pkl' or force_storage == 'pkl':
-        if not path.exists('%s/%s.pkl' % (args.destination, filename)):
-            print 'writing PICKLE cache "%s" (%s lines)' % (filename, len(dataframe))
-            dataframe.to_pickle('%s/%s.pkl' % (args.destination, filename))
-    else:
-        print 'writing HDF cache "%s" (%s lines)' % (filename, len(dataframe))
-        dataframe.to_hdf('%s/storage.hdf' % args.destination, filename.replace('.', '_'))
+    storage = force_storage if force_storage else args.storage
+    start = time()
+    cache.backend(storage).write(args.destination, filename, dataframe)
+    if inputs is None:
+        inputs = _cache_inputs(args)
+    cache.record(args.destination, filename, storage, inputs, params=params, lines=len(dataframe))
+    print 'cache "%s": written to %s (%s lines, %.2f s)' % (filename, storage, len(dataframe), time() - start)
 
 
-def read_cache(args, filename, csv_parser=None):
-    try:
-        print 'trying to read HDF cache "%s"' % filename
-        result = pandas.read_hdf('%s/storage.hdf' % args.destination, filename.replace('.', '_'))
-    except:
-        print 'failed to read HDF cache "%s"' % filename
-        try:
-            print 'trying to read PICKLE cache "%s"' % filename
-            result = pandas.read_pickle('%s/%s.pkl' % (args.destination, filename))
-        except:
-            print 'failed to read PICKLE cache "%s"' % filename
-            try:
-                print 'trying to read CSV cache "%s"' % filename
-                if csv_parser:
-                    result = csv_parser('%s/%s.csv' % (args.destination, filename))
-                else:
-                    result = pandas.read_csv('%s/%s.csv' % (args.destination, filename), index_col=False)
-                write_cache(args, result, filename, force_storage='pkl')
-            except:
-                print 'failed to read CSV cache "%s"' % filename
-                return None
-    print '%s lines loaded' % len(result)
+def read_cache(args, filename, csv_parser=None, params=None, columns=None, inputs=None):
+    if inputs is None:
+        inputs = _cache_inputs(args)
+    entry = cache.lookup(args.destination, filename, inputs, params=params)
+    if entry is None:
+        print 'cache "%s": miss' % filename
+        return None
+    storage = entry['storage']
+    backend = cache.backend(storage)
+    if not backend.exists(args.destination, filename):
+        print 'cache "%s": miss (not found in %s)' % (filename, storage)
+        return None
+    start = time()
+    result = backend.read(args.destination, filename, csv_parser=csv_parser, columns=columns)
+    print 'cache "%s": hit in %s (%s lines, %.2f s)' % (filename, storage, len(result), time() - start)
+    if storage != args.storage and columns is None:
+        write_cache(args, result, filename, params=params, inputs=inputs)
     return result
 
 
+def read_answers_cache(args, filename, params=None, columns=None):
+    '''
+    Read the cached answers and encode their A/B values and string columns
+    (the storages not supporting categorical columns keep them as strings).
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+        filename (str):
+            name of the cache entry
+        params (object, optional):
+            JSON serializable parameters of the entry
+        columns (list, optional):
+            names of the columns to read, None means all
+    Returns:
+        pandas.DataFrame: data frame containing answer data, or None
+    '''
+    data = read_cache(args, filename, csv_parser=answer.from_csv, params=params, columns=columns)
+    if data is not None:
+        data = decorator.encode_ab_values(data)
+        data = ids.encode_categories(data)
+    return data
+
+
 def data_hash(args):
     return ('apu_%s__dcs_%s__ocs_%s__dts_%s__mc_%s__pat_%s__mt_%s__du_%s__mind_%s__maxd_%s__do_%s__fab_%s' % (
         args.answers_per_user,
@@ -197,6 +279,32 @@ def data_hash(args):
         'x'.join(args.filter_abvalue if args.filter_abvalue else []))).replace(' ', '_')
 
 
+def required_columns(args, group_columns, columns=None):
+    '''
+    Compute the answer columns needed by the groups selected by the command
+    line arguments.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+        group_columns (dict):
+            group -> list of columns needed besides ANSWER_COLUMNS, None
+            if the group needs all the columns
+        columns (list, optional):
+            other columns needed regardless the selected groups
+    Returns:
+        list: names of the columns, or None if all the columns are needed
+    '''
+    result = set(ANSWER_COLUMNS + (columns if columns else []))
+    for group, group_cols in group_columns.iteritems():
+        if not is_group(args, group):
+            continue
+        if group_cols is None:
+            return None
+        result |= set(group_cols)
+    return sorted(result)
+
+
 def parser_group(parser, groups):
     parser.add_argument(
         '--groups',
@@ -213,109 +321,457 @@ def parser_group(parser, groups):
 
 
 def decorator_optimization(answers):
-    if len(answers) == 0:
-        print "There are no answers to analyze"
-        sys.exit()
-    decorated = decorator.rolling_success(
-        decorator.last_in_session(
-            decorator.session_number(answers)))
-    return decorated
+    _exit_if_empty(answers)
+    return decorator.decorate(answers)
 
 
 def load_feedback(args, data):
-    cache_filename = 'feedback.rating_%s' % hash(tuple(data['id']))
+    cache_filename = 'feedback.rating_%s' % cache.array_hash(data['id'].values)
     csv_parser = lambda f: pandas.read_csv(f, index_col=False, parse_dates=['inserted'])
-    feedback = read_cache(args, cache_filename, csv_parser=csv_parser)
+    filename = args.data_dir + '/feedback.rating.csv'
+    inputs = _cache_inputs(args, filename)
+    feedback = read_cache(args, cache_filename, csv_parser=csv_parser, inputs=inputs)
     if feedback is not None:
         return feedback
-    filename = args.data_dir + '/feedback.rating.csv'
     if not path.exists(filename):
         return None
     feedback = csv_parser(filename)
     feedback = decorator.success_before(feedback[feedback['user'].isin(data['user'].unique())], data)
-    write_cache(args, feedback, cache_filename)
+    write_cache(args, feedback, cache_filename, inputs=inputs)
     return feedback
 
 
-def load_answers(args, all_needed=True):
-    filename = 'geography.answer_%s' % data_hash(args)
+def load_answers(args, all_needed=True, columns=None):
     data_all = None
     if all_needed:
         data_all = load_answers_all(args)
-    data = read_cache(args, filename, csv_parser=answer.from_csv)
-    if data is not None:
-        return data, data_all
-    if args.min_date or args.max_date:
-        time_filename = 'geography.answer__mind_%s__maxd_%s__du_%s' % (args.min_date, args.max_date, args.drop_users)
-        data = read_cache(args, time_filename, csv_parser=answer.from_csv)
+    chain = filter_chain(args)
+    done = _cached_prefix(args, chain)
+    data = None
+    if done > 0:
+        prefix = chain[:done]
+        data = read_answers_cache(
+            args, _chain_filename(prefix), params=_chain_params(prefix),
+            columns=columns if done == len(chain) else None)
+        if data is not None:
+            cache.touch(args.destination, _chain_filename(prefix))
+        if data is not None and done == len(chain):
+            return data, data_all
     if data is None:
-        if all_needed:
+        done = 0
+        filters = len(time_filter_plan(args)) + len(filter_plan(args))
+        dataset = None if all_needed or filters == 0 else read_dataset(args)
+        storage = None if all_needed or filters == 0 or dataset is not None else _queryable_storage(args, 'geography.answer')
+        if dataset is not None:
+            data, done = load_answers_partitioned(args, dataset), filters
+        elif storage is not None:
+            data, done = load_answers_queried(args, storage), filters
+        elif not all_needed and filters > 0 and args.chunk_size:
+            data, done = load_answers_chunked(args), filters
+        elif all_needed:
             data = data_all
         else:
-            data = load_answers_all(args)
+            # without any filters the loaded answers are the result
+            data = load_answers_all(args, columns=columns if len(chain) == 0 else None)
+        if done > 0:
+            write_cache(args, data, _chain_filename(chain[:done]), params=_chain_params(chain[:done]))
+    for i in range(done, len(chain)):
+        data = chain[i][1](data)
+        write_cache(args, data, _chain_filename(chain[:i + 1]), params=_chain_params(chain[:i + 1]))
+    if len(chain) > 0:
+        cache.evict(args.destination, CHAIN_CACHE_PREFIX, args.chain_cache_limit)
+    return cache.project(data, columns), data_all
+
+
+def filter_chain(args):
+    '''
+    Prepare the ordered chain of the steps filtering all the answers to the
+    answers given by the command line arguments: the date limits and the
+    filters (see time_filter_plan and filter_plan), the classrooms, the
+    number of answers per user and the outliers. The answers filtered by
+    each prefix of the chain are cached under the name derived from the
+    descriptions of its steps, so the runs sharing the prefix (e.g. the same
+    date limits with different answers per user) resume from the longest
+    cached one.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        list: (JSON serializable description, function filtering the data
+        frame)
+    '''
+    if args.drop_classrooms and args.only_classrooms:
+        raise Exception("Can't have data both with and without classrooms")
+    # when the answers are filtered by maps or place types, the sequential
+    # columns are recomputed for the users whose answers are filtered out by
+    # each step including the date limits (the same as decorating the
+    # filtered answers again)
+    redecorate = _is_redecorated(args)
+    chain = []
+    for step in time_filter_plan(args):
+        name, _, drop_users = step
+        chain.append(([name, str(getattr(args, name)), drop_users, redecorate], _filter_step(step, redecorate)))
+    for step in filter_plan(args):
+        name, _, drop_users = step
+        chain.append(([name, getattr(args, name), drop_users, redecorate], _filter_step(step, redecorate)))
+    if args.drop_classrooms:
+        chain.append((
+            ['drop_classrooms', args.drop_classrooms],
+            lambda d: answer.drop_classrooms(d, classroom_size=args.drop_classrooms)[0]))
+    if args.only_classrooms:
+        chain.append((
+            ['only_classrooms', args.only_classrooms],
+            lambda d: answer.drop_classrooms(d, classroom_size=args.only_classrooms)[1]))
+    if args.answers_per_user:
+        chain.append((
+            ['answers_per_user', args.answers_per_user],
+            lambda d: answer.drop_users_by_answers(d, answer_limit_min=args.answers_per_user)))
+    if args.drop_outliers:
+        chain.append((['drop_outliers', args.drop_outliers], lambda d: _drop_outliers(d, args.drop_outliers)))
+    return chain
+
+
+def time_filter_plan(args):
+    '''
+    Prepare the list of predicates restricting the answers by the date limits
+    given by the command line arguments.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        list: (predicate name, function returning boolean mask, drop users)
+    '''
+    plan = []
     if args.min_date:
-        data = answer.apply_filter(data, lambda d: d['inserted'] >= args.min_date, drop_users=args.drop_users)
+        plan.append(('min_date', lambda d: (d['inserted'] >= args.min_date).values, args.drop_users))
     if args.max_date:
-        data = answer.apply_filter(data, lambda d: d['inserted'] <= args.max_date, drop_users=args.drop_users)
-    if args.min_date or args.max_date:
-        write_cache(args, data, time_filename)
+        plan.append(('max_date', lambda d: (d['inserted'] <= args.max_date).values, args.drop_users))
+    return plan
+
+
+def filter_plan(args):
+    '''
+    Prepare the list of predicates restricting the answers by the maps, place
+    types, A/B values and tests given by the command line arguments.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        list: (predicate name, function returning boolean mask, drop users)
+    '''
+    plan = []
     if args.map_code:
-        data = answer.apply_filter(data, lambda x: x['place_map_code'] in args.map_code, drop_users=args.drop_users)
+        plan.append(('map_code', lambda d: d['place_map_code'].isin(args.map_code).values, args.drop_users))
     if args.map_type:
-        data = answer.apply_filter(data, lambda x: x['place_map_type'] in args.map_type, drop_users=args.drop_users)
+        plan.append(('map_type', lambda d: d['place_map_type'].isin(args.map_type).values, args.drop_users))
     if args.place_asked_type:
-        data = answer.apply_filter(data, lambda x: x['place_asked_type'] in args.place_asked_type, drop_users=args.drop_users)
-    if args.map_code or args.place_asked_type or args.map_type:
-        del data['rolling_success']
-        del data['last_in_session']
-        del data['session_number']
-        data = decorator_optimization(data)
+        plan.append(('place_asked_type', lambda d: d['place_asked_type'].isin(args.place_asked_type).values, args.drop_users))
     if args.filter_abvalue:
-        data = answer.apply_filter(data, lambda d: all(map(lambda g: g in d['ab_values'], args.filter_abvalue)))
+        required = set(args.filter_abvalue)
+        plan.append(('filter_abvalue', lambda d: decorator.ab_values_mask(d, required.issubset), True))
     if args.drop_tests:
-        data = answer.apply_filter(data, lambda x: np.isnan(x['test_id']))
-    if args.drop_classrooms and args.only_classrooms:
-        raise Exception("Can't have data both with and without classrooms")
-    if args.drop_classrooms:
-        data, _ = answer.drop_classrooms(data, classroom_size=args.drop_classrooms)
-    if args.only_classrooms:
-        _, data = answer.drop_classrooms(data, classroom_size=args.only_classrooms)
-    if args.answers_per_user:
-        data = answer.drop_users_by_answers(data, answer_limit_min=args.answers_per_user)
-    if args.drop_outliers:
-        answers_per_user = user.answers_per_user(data)
-        [limit_min, limit_max] = np.percentile(answers_per_user.values(), [args.drop_outliers, 100 - args.drop_outliers])
-        valid_users = map(lambda (u, _): u, filter(lambda (u, n): n >= limit_min and n <= limit_max, answers_per_user.items()))
-        data = data[data['user'].isin(valid_users)]
-    write_cache(args, data, filename)
-    return data, data_all
+        plan.append(('drop_tests', lambda d: d['test_id'].isnull().values, True))
+    return plan
+
 
+def apply_filter_plan(data, plan):
+    '''
+    Apply the given predicates to the answers at once. The predicates are
+    evaluated as boolean masks over the whole data frame and combined in the
+    given order with the same semantics as the sequence of
+    proso.geography.answers.apply_filter calls, so the filtered data frame is
+    materialized only once.
 
-def load_answers_all(args):
-    data = read_cache(args, 'geography.answer', csv_parser=answer.from_csv)
+    Args:
+        data (pandas.DataFrame):
+            data frame containing answer data
+        plan (list):
+            (predicate name, function returning boolean mask, drop users)
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    if len(plan) == 0:
+        return data
+    users = data['user'].values
+    valid = np.ones(len(data), dtype=bool)
+    for name, mask_fun, drop_users in plan:
+        before = valid.sum()
+        mask = mask_fun(data)
+        invalid = valid & ~mask
+        valid &= mask
+        if drop_users and invalid.any():
+            valid &= ~np.in1d(users, np.unique(users[invalid]))
+        print 'filter "%s" removed %s answers' % (name, before - valid.sum())
+    return data[valid]
+
+
+def load_answers_all(args, columns=None):
+    data = read_answers_cache(args, 'geography.answer', columns=columns)
     if data is not None:
         return data
-    answers_file = args.answers if args.answers else args.data_dir + '/geography.answer.csv'
-    options_file = args.options if args.options else args.data_dir + '/geography.answer_options.csv'
-    ab_values_file = args.ab_values if args.ab_values else args.data_dir + '/geography.ab_value.csv'
-    answer_ab_values_file = args.answer_ab_values if args.answer_ab_values else args.data_dir + '/geography.answer_ab_values.csv'
-    place_file = args.places if args.places else args.data_dir + '/geography.place.csv'
-    if not path.exists(options_file):
-        options_file = None
-    if not path.exists(ab_values_file):
-        ab_values_file = None
-    if not path.exists(answer_ab_values_file):
-        answer_ab_values_file = None
-    data = answer.from_csv(
-        answer_csv=answers_file,
-        answer_options_csv=options_file,
-        answer_ab_values_csv=answer_ab_values_file,
-        ab_value_csv=ab_values_file,
-        place_csv=place_file,
-        should_sort=False)
-    data = decorator_optimization(data)
+    dataset = read_dataset(args)
+    if dataset is not None:
+        return _read_partitions(args, dataset['partitions'], columns=columns)
+    data = parse_answers_all(args)
     write_cache(args, data, 'geography.answer')
-    return data
+    return cache.project(data, columns)
+
+
+def parse_answers_all(args):
+    '''
+    Parse all the answers from the data files, join their options and A/B
+    values, encode them and decorate them.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    inputs = read_inputs(args)
+    data = inputs['answers']
+    if inputs['options'] is not None:
+        data['options'] = _collect_options(data['id'].values, inputs['options'])
+    if inputs['ab_values'] is not None and inputs['answer_ab_values'] is not None:
+        data = decorator.encode_ab_value_pairs(
+            data,
+            inputs['answer_ab_values']['answer'].values,
+            inputs['answer_ab_values']['value'].values,
+            dict(zip(inputs['ab_values']['id'].values, inputs['ab_values']['value'].values)))
+    inputs = None
+    return decorator_optimization(ids.encode(data))
+
+
+def read_inputs(args):
+    '''
+    Parse the input CSV files in parallel (the number of processes is given
+    by the --processes argument), so the time spent is close to the time of
+    parsing the largest file. The places are joined to the answers while
+    they are parsed.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        dict: 'answers', 'options', 'ab_values', 'answer_ab_values' -> data
+        frame, or None if the file does not exist
+    '''
+    answers_file, options_file, ab_values_file, answer_ab_values_file, place_file = _input_files(args)
+    tasks = [('answers', answers_file, place_file)]
+    for name, filename in [('options', options_file), ('ab_values', ab_values_file), ('answer_ab_values', answer_ab_values_file)]:
+        if path.exists(filename):
+            tasks.append((name, filename, None))
+    start = time()
+    if args.processes == 1:
+        results = map(_read_input, tasks)
+    else:
+        pool = multiprocessing.Pool(min(len(tasks), args.processes or multiprocessing.cpu_count()))
+        try:
+            results = pool.map(_read_input, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    inputs = {'options': None, 'ab_values': None, 'answer_ab_values': None}
+    for name, data, seconds in results:
+        print 'input "%s": parsed (%s lines, %.2f s)' % (name, len(data), seconds)
+        inputs[name] = data
+    print 'inputs parsed in %.2f s' % (time() - start)
+    return inputs
+
+
+def load_answers_chunked(args):
+    '''
+    Load the answers filtered by the date limits and the filters given by the
+    command line arguments (see time_filter_plan and filter_plan) without
+    materializing all the answers. The answer CSV is parsed in chunks of
+    args.chunk_size lines and only the answers passing the date and map
+    predicates are kept. For all the answers only the columns the sequential
+    decorations, user codes and filters are computed from are kept, so the
+    result is the same as filtering the answers loaded by load_answers_all.
+    The options and A/B values are read in chunks and joined only for the
+    kept answers.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    answers_file, options_file, ab_values_file, answer_ab_values_file, place_file = _input_files(args)
+    time_plan = time_filter_plan(args)
+    plan = filter_plan(args)
+    pushed = time_plan + [step for step in plan if step[0] in PUSHDOWN_FILTERS]
+    compact = []
+    masks = dict([(name, []) for name, _, _ in pushed])
+    categories = dict([(column, set()) for column in ids.CATEGORICAL_COLUMNS])
+    kept = []
+    for chunk in _answer_chunks(answers_file, place_file, args.chunk_size):
+        keep = np.ones(len(chunk), dtype=bool)
+        for name, mask_fun, _ in pushed:
+            mask = mask_fun(chunk)
+            masks[name].append(mask)
+            keep &= mask
+        for column in categories:
+            if column in chunk:
+                categories[column].update(chunk[column].dropna().unique())
+        compact.append(chunk[COMPACT_COLUMNS])
+        kept.append(chunk[keep])
+        print 'chunk of %s answers parsed, %s kept' % (len(chunk), keep.sum())
+    compact = pandas.concat(compact)
+    # concatenating the empty chunks would change the column types
+    data = pandas.concat([part for part in kept if len(part) > 0] or kept[:1])
+    masks = dict([(name, np.concatenate(parts)) for name, parts in masks.iteritems()])
+    kept = None
+    _exit_if_empty(compact)
+    if options_file and path.exists(options_file):
+        data['options'] = _options_for(data['id'].values, options_file, args.chunk_size)
+    if path.exists(ab_values_file) and path.exists(answer_ab_values_file):
+        ab_values = pandas.read_csv(ab_values_file, index_col=False)
+        answer_ab_values = _answer_ab_values_for(data['id'].values, answer_ab_values_file, args.chunk_size)
+        data = decorator.encode_ab_value_pairs(
+            data,
+            answer_ab_values['answer'].values,
+            answer_ab_values['value'].values,
+            dict(zip(ab_values['id'].values, ab_values['value'].values)))
+    for column, values in categories.iteritems():
+        if column in data:
+            data[column] = pandas.Categorical(data[column].values, categories=sorted(values))
+    data = ids.encode(data, ids.user_table(compact))
+    decorated = decorator.decorate(compact)
+    for column in decorated.columns:
+        if column not in compact:
+            data[column] = decorated[column].values[data.index.values]
+    return _filter_compact(args, compact, masks, data)
+
+
+def convert_dataset(args):
+    '''
+    Convert the data files to the partitioned dataset (args.dataset). The
+    parsed and decorated answers are partitioned by the month they were
+    inserted in and by the map code of the asked place, each partition is
+    stored in the columnar (npy) storage. The manifest of the dataset records
+    the month, map code, number of answers and min/max statistics of each
+    partition, so load_answers reads only the partitions matching the date
+    limits and map codes.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    '''
+    if read_dataset(args) is not None:
+        print 'dataset "%s": up to date' % args.dataset
+        return
+    if not path.exists(args.dataset):
+        makedirs(args.dataset)
+    previous = cache.load_manifest(args.dataset).get('dataset')
+    data = parse_answers_all(args)
+    start = time()
+    backend = cache.backend('npy')
+    months = data['inserted'].values.astype('datetime64[M]').astype(str)
+    map_codes = data['place_map_code'].astype(object).fillna('').values
+    partitions = []
+    groups = pandas.DataFrame({'month': months, 'map_code': map_codes}).groupby(['month', 'map_code']).indices
+    for (month, map_code), rows in sorted(groups.items()):
+        frame = data.iloc[np.sort(rows)]
+        name = 'geography.answer__month_%s__mc_%s' % (month, map_code if map_code else 'none')
+        backend.write(args.dataset, name, frame)
+        partitions.append({
+            'name': name,
+            'month': month,
+            'map_code': map_code if map_code else None,
+            'lines': len(frame),
+            'min': _partition_stats(frame, np.min),
+            'max': _partition_stats(frame, np.max),
+        })
+    if previous is not None:
+        names = set([partition['name'] for partition in partitions])
+        for name in set([partition['name'] for partition in previous['partitions']]) - names:
+            backend.remove(args.dataset, name)
+    cache.record(args.dataset, 'dataset', 'npy', _cache_inputs(args), partitions=partitions, lines=len(data))
+    print 'dataset "%s": written (%s partitions, %s lines, %.2f s)' % (args.dataset, len(partitions), len(data), time() - start)
+
+
+def read_dataset(args):
+    '''
+    Find the manifest entry of the partitioned dataset given by the command
+    line arguments.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+    Returns:
+        dict: manifest entry, or None if there is no dataset or it is stale
+    '''
+    if not args.dataset:
+        return None
+    dataset = cache.lookup(args.dataset, 'dataset', _cache_inputs(args))
+    if dataset is None:
+        print 'dataset "%s": miss (not converted from the current data files)' % args.dataset
+    return dataset
+
+
+def load_answers_partitioned(args, dataset):
+    '''
+    Load the answers filtered by the date limits and the filters given by the
+    command line arguments from the partitioned dataset. Only the partitions
+    matching the date limits and map codes are read whole. From the other
+    partitions only the columns the filters are evaluated on are read, since
+    the filters dropping users and the redecoration depend on all the
+    answers. The partitions outside the date limits are skipped completely
+    when no users are dropped and the answers are not redecorated.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+        dataset (dict):
+            manifest entry of the dataset
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    time_plan = time_filter_plan(args)
+    plan = filter_plan(args)
+    pushed = time_plan + [step for step in plan if step[0] in PUSHDOWN_FILTERS]
+    partitions = dataset['partitions']
+    if not args.drop_users and not _is_redecorated(args):
+        partitions = [partition for partition in partitions if _partition_in_time(args, partition)]
+    matching = [partition for partition in partitions if _partition_matches(args, partition)]
+    print 'dataset "%s": %s of %s partitions matching' % (args.dataset, len(matching), len(dataset['partitions']))
+    columns = ['user', 'inserted'] + [PUSHDOWN_COLUMNS[name] for name, _, _ in pushed if name in PUSHDOWN_COLUMNS]
+    compact = _read_partitions(args, partitions, columns=columns)
+    data = _read_partitions(args, matching)
+    masks = dict([(name, mask_fun(compact)) for name, mask_fun, _ in pushed])
+    keep = np.ones(len(data), dtype=bool)
+    for name, mask_fun, _ in pushed:
+        keep &= mask_fun(data)
+    return _filter_compact(args, compact, masks, data[keep])
+
+
+def load_session_summary(args, data):
+    '''
+    Load the session summary (see proso.geography.session.summary) of the
+    answers loaded by load_answers and keep it with them, so the session
+    metrics computed on the answers reuse it.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+        data (pandas.DataFrame):
+            data frame containing answer data returned by load_answers
+    Returns:
+        pandas.DataFrame: session summary
+    '''
+    filename = 'geography.session_summary_%s' % data_hash(args)
+    sessions = read_cache(
+        args, filename, params=data_hash(args),
+        csv_parser=lambda f: pandas.read_csv(f, index_col=False, parse_dates=['start', 'end']))
+    if sessions is None:
+        sessions = session.summary(data)
+        write_cache(args, sessions, filename, params=data_hash(args))
+        return sessions
+    return ids.frame_cached(data, 'session_summary', lambda: sessions, columns=session.SUMMARY_COLUMNS)
 
 
 def load_difficulty_and_prior_skill(args, data_all):
@@ -326,13 +782,105 @@ def load_difficulty_and_prior_skill(args, data_all):
             proso.geography.difficulty.dataframe_to_difficulty(difficulty) if difficulty is not None else None,
             proso.geography.user.dataframe_to_prior_skill(prior_skill) if prior_skill is not None else None
         )
-    difficulty, prior_skill = proso.geography.difficulty.prepare_difficulty_and_prior_skill(data_all)
+    if args.difficulty_engine == 'stream':
+        difficulty, prior_skill = proso.geography.difficulty.prepare_difficulty_and_prior_skill(
+            data_all, engine='stream')
+    else:
+        previous = None
+        if args.difficulty_checkpoint:
+            previous = read_difficulty_checkpoint(args.difficulty_checkpoint)
+        checkpoint = proso.geography.difficulty.prepare_checkpoint(data_all, previous)
+        write_difficulty_checkpoint(args, checkpoint)
+        difficulty, prior_skill = proso.geography.difficulty.checkpoint_to_difficulty_and_prior_skill(checkpoint)
     write_cache(args, proso.geography.difficulty.difficulty_to_dataframe(difficulty), 'difficulty')
     write_cache(args, proso.geography.user.prior_skill_to_dataframe(prior_skill), 'prior_skill')
     gc.collect()
     return difficulty, prior_skill
 
 
+def load_difficulty_and_prior_skill_variants(args, data_all, variants, difficulty=None):
+    '''
+    Load the difficulty and prior skill for several variants of the model,
+    each variant is cached on its own. The missing variants are computed
+    in parallel (see proso.geography.difficulty.prepare_variants).
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+        data_all (pandas.DataFrame):
+            data frame containing all answer data, if it is None, only the
+            cached variants are loaded
+        variants (dict):
+            name -> JSON serializable variant
+        difficulty (dict, optional):
+            place -> difficulty preserved by the variants asking for it
+    Returns:
+        dict: name -> (dict: place -> difficulty, dict: user's id -> prior skill)
+    '''
+    result = {}
+    missing = {}
+    for name, variant in variants.iteritems():
+        variant_difficulty = read_cache(args, 'difficulty_' + name, params=variant)
+        variant_prior_skill = read_cache(args, 'prior_skill_' + name, params=variant)
+        if variant_difficulty is None or variant_prior_skill is None:
+            missing[name] = variant
+            continue
+        result[name] = (
+            proso.geography.difficulty.dataframe_to_difficulty(variant_difficulty),
+            proso.geography.user.dataframe_to_prior_skill(variant_prior_skill))
+    if not missing or data_all is None:
+        return result
+    computed = proso.geography.difficulty.prepare_variants(
+        data_all, missing, difficulty=difficulty, processes=args.processes)
+    for name, (variant_difficulty, variant_prior_skill) in computed.iteritems():
+        write_cache(args, proso.geography.difficulty.difficulty_to_dataframe(variant_difficulty), 'difficulty_' + name, params=missing[name])
+        write_cache(args, proso.geography.user.prior_skill_to_dataframe(variant_prior_skill), 'prior_skill_' + name, params=missing[name])
+    result.update(computed)
+    gc.collect()
+    return result
+
+
+def read_difficulty_checkpoint(directory):
+    '''
+    Read the checkpoint of the difficulty and prior skill stored in the given
+    directory. Unlike the other cache entries the checkpoint is read even if
+    the data it has been computed from has changed, since it is used to
+    continue with the newer data.
+
+    Args:
+        directory (str):
+            destination of the analysis the checkpoint has been written by
+    Returns:
+        dict: checkpoint (see proso.geography.elo.checkpoint), or None if
+        there is no checkpoint in the directory
+    '''
+    manifest = cache.load_manifest(directory)
+    checkpoint = {}
+    for part in CHECKPOINT_PARTS:
+        name = 'difficulty_checkpoint_' + part
+        entry = manifest.get(name)
+        if entry is None or entry['version'] != cache.CACHE_VERSION:
+            print 'difficulty checkpoint: miss in %s' % directory
+            return None
+        if 'last_id' in checkpoint and checkpoint['last_id'] != entry['params']['last_id']:
+            print 'difficulty checkpoint: inconsistent in %s' % directory
+            return None
+        checkpoint[part] = cache.backend(entry['storage']).read(directory, name)
+        checkpoint['last_id'] = entry['params']['last_id']
+    print 'difficulty checkpoint: hit in %s (last answer %s)' % (directory, checkpoint['last_id'])
+    return checkpoint
+
+
+def write_difficulty_checkpoint(args, checkpoint):
+    # CSV does not keep the full precision of floats, the replay continued
+    # from a rounded state would not give the same estimates
+    storage = 'pkl' if args.storage == 'csv' else None
+    for part in CHECKPOINT_PARTS:
+        write_cache(
+            args, checkpoint[part], 'difficulty_checkpoint_' + part,
+            force_storage=storage, params={'last_id': checkpoint['last_id']})
+
+
 def get_destination(args, prefix=''):
     dest_file = args.destination + '/' + prefix + data_hash(args)
     if not path.exists(dest_file):
@@ -358,5 +906,253 @@ def is_any_group(args, groups):
     return any([is_group(args, group) for group in groups])
 
 
+def _input_files(args):
+    return [
+        args.answers if args.answers else args.data_dir + '/geography.answer.csv',
+        args.options if args.options else args.data_dir + '/geography.answer_options.csv',
+        args.ab_values if args.ab_values else args.data_dir + '/geography.ab_value.csv',
+        args.answer_ab_values if args.answer_ab_values else args.data_dir + '/geography.answer_ab_values.csv',
+        args.places if args.places else args.data_dir + '/geography.place.csv',
+    ]
+
+
+def _cache_inputs(args, *other):
+    # the existing answer files (and the given other files) a cache entry is computed from
+    return filter(path.exists, _input_files(args) + list(other))
+
+
+def _exit_if_empty(answers):
+    if len(answers) == 0:
+        print "There are no answers to analyze"
+        sys.exit()
+
+
+def _answer_chunks(answers_file, place_file, chunk_size):
+    with open(answers_file) as f:
+        header = f.readline()
+        offset = 0
+        while True:
+            lines = list(islice(f, chunk_size))
+            if len(lines) == 0:
+                break
+            chunk = answer.from_csv(
+                answer_csv=StringIO(header + ''.join(lines)),
+                place_csv=place_file,
+                should_sort=False)
+            chunk.index = np.arange(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+
+
+def _read_input(task):
+    name, filename, place_file = task
+    start = time()
+    if name == 'answers':
+        data = answer.from_csv(answer_csv=filename, place_csv=place_file, should_sort=False)
+    else:
+        data = pandas.read_csv(filename, index_col=False)
+    return name, data, time() - start
+
+
+def _options_for(answer_ids, options_file, chunk_size):
+    # only the options of the given answers are read
+    return _collect_options(answer_ids, pandas.concat([
+        chunk[np.in1d(chunk['answer'].values, answer_ids)]
+        for chunk in pandas.read_csv(options_file, index_col=False, chunksize=chunk_size)
+    ]))
+
+
+def _answer_ab_values_for(answer_ids, answer_ab_values_file, chunk_size):
+    # only the (answer, A/B value) pairs of the given answers are read
+    return pandas.concat([
+        chunk[np.in1d(chunk['answer'].values, answer_ids)]
+        for chunk in pandas.read_csv(answer_ab_values_file, index_col=False, chunksize=chunk_size)
+    ])
+
+
+def _collect_options(answer_ids, options):
+    # the same as proso.geography.answers.options_from_csv for the already
+    # parsed options
+    options = options.sort(['answer', 'id'])
+    options_dict = {}
+    for answer_id, place in zip(options['answer'].values, options['place'].values):
+        options_dict.setdefault(answer_id, []).append(place)
+    return map(lambda answer_id: options_dict.get(answer_id, []), answer_ids)
+
+
+def load_answers_queried(args, storage):
+    '''
+    Load the answers filtered by the date limits and the filters given by the
+    command line arguments from the cached answers stored as the queryable
+    HDF table (see proso.geography.cache.HDFTableBackend). The date and map
+    predicates are pushed down as where queries, so only the matching rows
+    are read whole. For the other answers within the date limits (all the
+    answers when users are dropped or the answers are redecorated) only the
+    columns the filters are evaluated on are read, since the filters
+    dropping users and the redecoration depend on them.
+
+    Args:
+        args (argparse.Namespace):
+            parsed command line arguments
+        storage (str):
+            storage of the cached answers
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    backend = cache.backend(storage)
+    time_plan = time_filter_plan(args)
+    plan = filter_plan(args)
+    pushed = time_plan + [step for step in plan if step[0] in PUSHDOWN_COLUMNS]
+    time_where = [] if args.drop_users or _is_redecorated(args) else _where_terms(args, [name for name, _, _ in time_plan])
+    where = _where_terms(args, [name for name, _, _ in time_plan + plan])
+    start = time()
+    columns = ['user', 'inserted'] + [PUSHDOWN_COLUMNS[name] for name, _, _ in pushed if name in PUSHDOWN_COLUMNS]
+    compact = backend.select(args.destination, 'geography.answer', where=time_where or None, columns=columns)
+    data = backend.select(args.destination, 'geography.answer', where=where or None)
+    print 'cache "geography.answer": queried in %s (%s of %s lines, %.2f s)' % (storage, len(data), len(compact), time() - start)
+    _exit_if_empty(compact)
+    masks = dict([(name, mask_fun(compact)) for name, mask_fun, _ in pushed])
+    return _filter_compact(args, compact, masks, data)
+
+
+def _filter_step(step, redecorate):
+    def _filter(data):
+        filtered = apply_filter_plan(data, [step])
+        if redecorate:
+            _exit_if_empty(filtered)
+            filtered = decorator.redecorate(filtered, _users_with_removed_answers(data, filtered))
+        return filtered
+    return _filter
+
+
+def _drop_outliers(data, percentile):
+    answers_per_user = user.answers_per_user(data)
+    [limit_min, limit_max] = np.percentile(answers_per_user.values(), [percentile, 100 - percentile])
+    valid_users = map(lambda (u, _): u, filter(lambda (u, n): n >= limit_min and n <= limit_max, answers_per_user.items()))
+    return data[data['user'].isin(valid_users)]
+
+
+def _chain_params(chain):
+    return [description for description, _ in chain]
+
+
+def _chain_filename(chain):
+    digest = hashlib.sha1(json.dumps(_chain_params(chain), sort_keys=True))
+    return CHAIN_CACHE_PREFIX + digest.hexdigest()[:16]
+
+
+def _cached_prefix(args, chain):
+    # length of the longest prefix of the chain having a valid cache entry
+    inputs = _cache_inputs(args)
+    for length in range(len(chain), 0, -1):
+        if cache.lookup(args.destination, _chain_filename(chain[:length]), inputs, params=_chain_params(chain[:length])) is not None:
+            return length
+    return 0
+
+
+def _filter_compact(args, compact, masks, data):
+    # apply the date limits and filters to the answers loaded partially:
+    # compact contains a few columns of all the answers the filters depend
+    # on, masks are the pushed predicates evaluated for them and data are
+    # the answers passing the pushed predicates
+    time_plan = time_filter_plan(args)
+    plan = filter_plan(args)
+    positions = compact.index.values
+    compact_plan = [(name, _compact_mask(positions, masks[name]), drop_users) for name, _, drop_users in time_plan]
+    timed = apply_filter_plan(compact, compact_plan)
+    compact_plan = [
+        (name, _compact_mask(positions, masks[name]) if name in masks else _compact_mask(positions, mask_fun(data), data.index.values), drop_users)
+        for name, mask_fun, drop_users in plan
+    ]
+    filtered = apply_filter_plan(timed, compact_plan)
+    data = data.loc[filtered.index]
+    if _is_redecorated(args):
+        # the compact data frame contains all the answers in this case
+        _exit_if_empty(data)
+        data = decorator.redecorate(data, _users_with_removed_answers(compact, filtered))
+    return data
+
+
+def _is_redecorated(args):
+    # the sequential columns of the filtered answers are recomputed only when
+    # the answers are filtered by maps or place types
+    return bool(args.map_code or args.place_asked_type or args.map_type)
+
+
+def _compact_mask(positions, mask, rows=None):
+    # predicate over the compact data frame (indexed by the position of the
+    # answer in the CSV, the positions are sorted), the mask is given for all
+    # the answers or only for the given rows (the other answers have been
+    # already filtered out)
+    if rows is not None:
+        full = np.ones(len(positions), dtype=bool)
+        full[np.searchsorted(positions, rows)] = mask
+        mask = full
+    return lambda d: mask[np.searchsorted(positions, d.index.values)]
+
+
+def _queryable_storage(args, filename):
+    # storage of the valid cache entry if it can be queried, otherwise None
+    entry = cache.lookup(args.destination, filename, _cache_inputs(args))
+    if entry is None or not isinstance(cache.backend(entry['storage']), cache.HDFTableBackend):
+        return None
+    if not cache.backend(entry['storage']).exists(args.destination, filename):
+        return None
+    return entry['storage']
+
+
+def _where_terms(args, names):
+    # where query (see pandas.HDFStore.select) of the given filters
+    terms = {
+        'min_date': lambda: 'inserted >= %r' % str(args.min_date),
+        'max_date': lambda: 'inserted <= %r' % str(args.max_date),
+        'map_code': lambda: 'place_map_code in %r' % list(args.map_code),
+        'map_type': lambda: 'place_map_type in %r' % list(args.map_type),
+        'place_asked_type': lambda: 'place_asked_type in %r' % list(args.place_asked_type),
+    }
+    return [terms[name]() for name in names if name in terms]
+
+
+def _read_partitions(args, partitions, columns=None):
+    # the answers of the given partitions of the dataset in their original
+    # order
+    backend = cache.backend('npy')
+    start = time()
+    parts = [backend.read(args.dataset, partition['name'], columns=columns) for partition in partitions]
+    _exit_if_empty(parts)
+    # concatenating the empty partitions would change the column types
+    data = pandas.concat([part for part in parts if len(part) > 0] or parts[:1]).sort()
+    print 'dataset "%s": %s partitions read (%s lines, %.2f s)' % (args.dataset, len(parts), len(data), time() - start)
+    return data
+
+
+def _partition_in_time(args, partition):
+    if args.min_date and pandas.Timestamp(partition['max']['inserted']) < args.min_date:
+        return False
+    if args.max_date and pandas.Timestamp(partition['min']['inserted']) > args.max_date:
+        return False
+    return True
+
+
+def _partition_matches(args, partition):
+    if not _partition_in_time(args, partition):
+        return False
+    return not args.map_code or partition['map_code'] in args.map_code
+
+
+def _partition_stats(partition, reduce_fun):
+    return {
+        'inserted': str(pandas.Timestamp(reduce_fun(partition['inserted'].values))),
+        'id': int(reduce_fun(partition['id'].values)),
+        'user': int(reduce_fun(partition['user'].values)),
+    }
+
+
+def _users_with_removed_answers(data, filtered):
+    before = data['user'].value_counts()
+    after = filtered['user'].value_counts()
+    return after.index.values[after.values != before[after.index].values]
+
+
 def _is_required(required, name):
     return required is not None and name in required
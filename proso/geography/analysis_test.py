@@ -0,0 +1,139 @@
+import numpy as np
+import os
+import pandas
+import proso.geography.analysis as analysis
+import proso.geography.cache as cache
+import proso.geography.decorator as decorator
+import proso.geography.testing as testing
+import shutil
+import tempfile
+import unittest
+
+
+SEQUENTIAL_COLUMNS = ['session_number', 'last_in_session', 'rolling_success']
+
+CASES = [
+    ['--min-date', '2014-10-20'],
+    ['--min-date', '2014-10-20', '--map-code', 'cz'],
+    ['--min-date', '2014-10-10', '--max-date', '2014-11-10', '--map-type', 'state'],
+    ['--max-date', '2014-11-01', '--place-asked-type', 'city', '--drop-tests'],
+    ['--map-code', 'cz', 'us', '--drop-users'],
+    ['--map-code', 'world', '--answers-per-user', '10'],
+]
+
+
+class FilterChainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.answers = _answers()
+
+    def test_redecoration(self):
+        for case in CASES:
+            args = _args(case)
+            filtered = _apply_chain(args, self.answers)
+            self.assertTrue(len(filtered) > 0)
+            if analysis._is_redecorated(args):
+                expected = decorator.decorate(filtered.drop(SEQUENTIAL_COLUMNS, axis=1))
+            else:
+                expected = self.answers.loc[filtered.index]
+            for column in SEQUENTIAL_COLUMNS:
+                self.assertTrue(
+                    _same(filtered[column].values, expected[column].values),
+                    'column %s differs for %s' % (column, case))
+
+    def test_filter_compact(self):
+        for case in CASES:
+            args = _args(case)
+            pushed = analysis.time_filter_plan(args) + [
+                step for step in analysis.filter_plan(args) if step[0] in analysis.PUSHDOWN_COLUMNS
+            ]
+            masks = dict([(name, mask_fun(self.answers)) for name, mask_fun, _ in pushed])
+            keep = np.ones(len(self.answers), dtype=bool)
+            for mask in masks.values():
+                keep &= mask
+            compact = self.answers[['user', 'inserted', 'place_map_code', 'place_map_type', 'place_asked_type', 'test_id']]
+            loaded = analysis._filter_compact(args, compact, masks, self.answers[keep])
+            filtered = analysis.apply_filter_plan(self.answers, analysis.time_filter_plan(args) + analysis.filter_plan(args))
+            self.assertEqual(list(loaded.index), list(filtered.index))
+            if analysis._is_redecorated(args):
+                expected = decorator.decorate(filtered.drop(SEQUENTIAL_COLUMNS, axis=1))
+                for column in SEQUENTIAL_COLUMNS:
+                    self.assertTrue(_same(loaded[column].values, expected[column].values))
+
+    def test_chain_descriptions(self):
+        first = analysis.filter_chain(_args(['--min-date', '2014-10-20', '--answers-per-user', '10']))
+        second = analysis.filter_chain(_args(['--min-date', '2014-10-20', '--answers-per-user', '20']))
+        self.assertEqual(
+            analysis._chain_filename(first[:1]),
+            analysis._chain_filename(second[:1]))
+        self.assertNotEqual(
+            analysis._chain_filename(first),
+            analysis._chain_filename(second))
+        # the date step redecorates the answers only with the map filters
+        redecorated = analysis.filter_chain(_args(['--min-date', '2014-10-20', '--map-code', 'cz']))
+        self.assertNotEqual(
+            analysis._chain_filename(first[:1]),
+            analysis._chain_filename(redecorated[:1]))
+
+
+class CacheInputsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.args = analysis.parser_init().parse_args([
+            '-d', os.path.join(self.directory, 'destination'),
+            '--data-dir', self.directory,
+            '--storage', 'pkl'])
+        for filename in ['geography.answer.csv', 'feedback.rating.csv']:
+            with open(os.path.join(self.directory, filename), 'w') as f:
+                f.write('id\n1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_feedback_only_for_feedback(self):
+        frame = pandas.DataFrame({'id': [1, 2]})
+        feedback_file = os.path.join(self.directory, 'feedback.rating.csv')
+        analysis.write_cache(self.args, frame, 'geography.answer')
+        analysis.write_cache(self.args, frame, 'feedback.rating_x', inputs=analysis._cache_inputs(self.args, feedback_file))
+        manifest = cache.load_manifest(self.args.destination)
+        self.assertEqual(
+            sorted(manifest['geography.answer']['inputs'].keys()),
+            [os.path.join(self.directory, 'geography.answer.csv')])
+        self.assertEqual(
+            sorted(manifest['feedback.rating_x']['inputs'].keys()),
+            sorted([os.path.join(self.directory, 'geography.answer.csv'), feedback_file]))
+        with open(feedback_file, 'a') as f:
+            f.write('2\n')
+        self.assertTrue(analysis.read_cache(self.args, 'geography.answer') is not None)
+        self.assertTrue(analysis.read_cache(
+            self.args, 'feedback.rating_x', inputs=analysis._cache_inputs(self.args, feedback_file)) is None)
+
+
+def _same(values, expected):
+    return pandas.Series(values).equals(pandas.Series(expected))
+
+
+def _args(case):
+    return analysis.parser_init().parse_args(['-d', '/tmp/destination'] + case)
+
+
+def _apply_chain(args, answers):
+    for _, step in analysis.filter_chain(args):
+        answers = step(answers)
+    return answers
+
+
+def _answers():
+    return decorator.decorate(testing.random_answers(
+        n=4000, users=40, days=60, correct=0.6,
+        place_map_code=lambda rng, answers: pandas.Categorical(_map_codes(rng, answers['user'].values)),
+        place_map_type=lambda rng, answers: pandas.Categorical(rng.choice(['state', 'continent'], len(answers))),
+        place_asked_type=lambda rng, answers: pandas.Categorical(rng.choice(['city', 'state', 'river'], len(answers))),
+        test_id=lambda rng, answers: np.where(rng.rand(len(answers)) < 0.01, 5, np.nan)))
+
+
+def _map_codes(rng, users):
+    # most users practice only one map, so dropping the users keeps some
+    codes = np.array(['cz', 'us', 'world'])
+    return np.where(users % 4 == 0, rng.choice(codes, len(users)), codes[users % 3])
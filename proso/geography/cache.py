@@ -0,0 +1,551 @@
+"""
+Storage backends and manifest of the cached data frames. For each cache
+entry the manifest records the backend it is stored in, fingerprints of the
+input files the entry was computed from, its parameters and the version of
+the code, so stale entries are detected without reading them.
+"""
+
+from contextlib import contextmanager
+from os import chmod, fdopen, makedirs, path, remove, rename, stat
+from shutil import rmtree
+from time import time
+import fcntl
+import hashlib
+import json
+import tempfile
+import numpy as np
+import pandas
+
+CACHE_VERSION = 4
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_LOCK_FILE = 'manifest.lock'
+
+_CONTENT_HASHES = {}
+
+
+class Backend:
+
+    """
+    Storage of the cached data frames in the given directory.
+    """
+
+    def exists(self, directory, name):
+        """
+        Check whether the entry with the given name is stored.
+
+        Returns:
+            bool
+        """
+        raise NotImplementedError()
+
+    def read(self, directory, name, csv_parser=None, columns=None):
+        """
+        Read the entry with the given name. If the columns are given, only
+        these columns are returned.
+
+        Returns:
+            pandas.DataFrame
+        """
+        raise NotImplementedError()
+
+    def write(self, directory, name, dataframe):
+        """
+        Write the given data frame as the entry with the given name.
+        """
+        raise NotImplementedError()
+
+    def remove(self, directory, name):
+        """
+        Remove the entry with the given name if it is stored.
+        """
+        raise NotImplementedError()
+
+
+class CSVBackend(Backend):
+
+    def exists(self, directory, name):
+        return path.exists(self._filename(directory, name))
+
+    def read(self, directory, name, csv_parser=None, columns=None):
+        if csv_parser:
+            return project(csv_parser(self._filename(directory, name)), columns)
+        return project(pandas.read_csv(self._filename(directory, name), index_col=False), columns)
+
+    def write(self, directory, name, dataframe):
+        dataframe.to_csv(self._filename(directory, name), index=False)
+
+    def remove(self, directory, name):
+        if self.exists(directory, name):
+            remove(self._filename(directory, name))
+
+    def _filename(self, directory, name):
+        return '%s/%s.csv' % (directory, name)
+
+
+class PickleBackend(Backend):
+
+    def exists(self, directory, name):
+        return path.exists(self._filename(directory, name))
+
+    def read(self, directory, name, csv_parser=None, columns=None):
+        return project(pandas.read_pickle(self._filename(directory, name)), columns)
+
+    def write(self, directory, name, dataframe):
+        dataframe.to_pickle(self._filename(directory, name))
+
+    def remove(self, directory, name):
+        if self.exists(directory, name):
+            remove(self._filename(directory, name))
+
+    def _filename(self, directory, name):
+        return '%s/%s.pkl' % (directory, name)
+
+
+class HDFBackend(Backend):
+
+    def exists(self, directory, name):
+        filename = self._filename(directory)
+        if not path.exists(filename):
+            return False
+        store = pandas.HDFStore(filename, mode='r')
+        try:
+            return '/' + self._key(name) in store.keys()
+        finally:
+            store.close()
+
+    def read(self, directory, name, csv_parser=None, columns=None):
+        return project(pandas.read_hdf(self._filename(directory), self._key(name)), columns)
+
+    def write(self, directory, name, dataframe):
+        # the fixed format does not support categorical columns
+        categorical = [column for column in dataframe.columns if str(dataframe[column].dtype) == 'category']
+        if categorical:
+            dataframe = dataframe.copy()
+            for column in categorical:
+                dataframe[column] = np.asarray(dataframe[column].values)
+        dataframe.to_hdf(self._filename(directory), self._key(name))
+
+    def remove(self, directory, name):
+        # the space of the removed entry is reused by the next entries, the
+        # file does not shrink
+        if self.exists(directory, name):
+            store = pandas.HDFStore(self._filename(directory))
+            try:
+                store.remove(self._key(name))
+            finally:
+                store.close()
+
+    def _filename(self, directory):
+        return '%s/storage.hdf' % directory
+
+    def _key(self, name):
+        return name.replace('.', '_')
+
+
+class HDFTableBackend(HDFBackend):
+
+    """
+    Queryable storage: the data frames are stored in the table format with
+    the columns the answers are usually filtered by (DATA_COLUMNS) indexed as
+    data columns, so the rows can be selected by a where query (see select)
+    without reading the whole data frame. The columns containing lists of
+    integers (e.g. options) are stored as strings. The tables are compressed
+    when the compression library is given.
+    """
+
+    DATA_COLUMNS = ['inserted', 'place_map_code', 'place_map_type', 'place_asked_type', 'test_id']
+
+    def __init__(self, complevel=None, complib=None):
+        self._complevel = complevel
+        self._complib = complib
+
+    def read(self, directory, name, csv_parser=None, columns=None):
+        return self.select(directory, name, columns=columns)
+
+    def select(self, directory, name, where=None, columns=None):
+        """
+        Read the rows of the entry with the given name satisfying the where
+        query (see pandas.HDFStore.select), e.g. ['inserted >= "2014-11-05"',
+        'place_map_code in ["cz"]'], only the data columns can be queried.
+
+        Returns:
+            pandas.DataFrame
+        """
+        store = pandas.HDFStore(self._filename(directory), mode='r')
+        try:
+            storer = store.get_storer(self._key(name))
+            list_columns = getattr(storer.attrs, 'list_columns', [])
+            dtypes = getattr(storer.attrs, 'dtypes', {})
+            if columns is not None:
+                columns = [column for column in storer.non_index_axes[0][1] if column in columns]
+            data = store.select(self._key(name), where=where, columns=columns)
+        finally:
+            store.close()
+        for column in list_columns:
+            if column in data:
+                data[column] = [_str2list(value) for value in data[column].values]
+        # the tables lose the type of the float16 columns containing only
+        # missing values
+        for column, dtype in dtypes.iteritems():
+            if column in data and str(data[column].dtype) != dtype:
+                data[column] = data[column].values.astype(dtype)
+        return data
+
+    def write(self, directory, name, dataframe):
+        list_columns = [
+            column for column in dataframe.columns
+            if dataframe[column].dtype == object and len(dataframe) > 0 and isinstance(dataframe[column].values[0], list)
+        ]
+        if list_columns:
+            dataframe = dataframe.copy()
+            for column in list_columns:
+                dataframe[column] = [','.join(map(str, value)) for value in dataframe[column].values]
+        store = pandas.HDFStore(self._filename(directory), complevel=self._complevel, complib=self._complib)
+        try:
+            if '/' + self._key(name) in store.keys():
+                store.remove(self._key(name))
+            store.put(
+                self._key(name), dataframe, format='table',
+                data_columns=[column for column in self.DATA_COLUMNS if column in dataframe])
+            store.get_storer(self._key(name)).attrs.list_columns = list_columns
+            store.get_storer(self._key(name)).attrs.dtypes = dict([
+                (column, str(dataframe[column].dtype))
+                for column in dataframe.columns
+                if dataframe[column].dtype.kind == 'f'
+            ])
+        finally:
+            store.close()
+
+
+class NumpyBackend(Backend):
+
+    """
+    Columnar storage: each column is saved as a raw numpy array in its own
+    file (object columns are pickled, categorical columns are saved as codes
+    and categories) and the column names and types are
+    kept in a schema file. The arrays are memory-mapped (copy-on-write) when
+    read, so the data is paged in only when touched and the page cache is
+    shared by all the processes reading the same cache.
+    """
+
+    SCHEMA_FILE = 'schema.json'
+
+    def exists(self, directory, name):
+        return path.exists(path.join(self._dirname(directory, name), self.SCHEMA_FILE))
+
+    def read(self, directory, name, csv_parser=None, columns=None):
+        dirname = self._dirname(directory, name)
+        with open(path.join(dirname, self.SCHEMA_FILE)) as f:
+            schema = json.load(f)
+        data = pandas.DataFrame(index=self._load(dirname, schema['index']))
+        for column in schema['columns']:
+            if columns is None or column['name'] in columns:
+                data[column['name']] = self._load(dirname, column)
+        return data
+
+    def write(self, directory, name, dataframe):
+        dirname = self._dirname(directory, name)
+        if not path.exists(dirname):
+            makedirs(dirname)
+        schema_file = path.join(dirname, self.SCHEMA_FILE)
+        if path.exists(schema_file):
+            remove(schema_file)
+        schema = {
+            'index': self._save(dirname, 'index', dataframe.index.values),
+            'columns': [],
+        }
+        for i, column in enumerate(dataframe.columns):
+            saved = self._save(dirname, str(i), dataframe[column].values)
+            saved['name'] = column
+            schema['columns'].append(saved)
+        with open(schema_file, 'w') as f:
+            json.dump(schema, f, indent=1)
+
+    def remove(self, directory, name):
+        rmtree(self._dirname(directory, name), ignore_errors=True)
+
+    def _dirname(self, directory, name):
+        return '%s/%s.columns' % (directory, name)
+
+    def _save(self, dirname, filename, values):
+        if isinstance(values, pandas.Categorical):
+            saved = self._save(dirname, filename, values.codes)
+            saved['categories'] = self._save(dirname, filename + '.categories', values.categories.values)
+            return saved
+        if values.dtype == object:
+            filename += '.pkl'
+            pandas.Series(values).to_pickle(path.join(dirname, filename))
+        else:
+            filename += '.npy'
+            np.save(path.join(dirname, filename), values)
+        return {'file': filename, 'dtype': str(values.dtype)}
+
+    def _load(self, dirname, saved):
+        filename = path.join(dirname, saved['file'])
+        if 'categories' in saved:
+            return pandas.Categorical.from_codes(
+                np.load(filename), self._load(dirname, saved['categories']))
+        if saved['file'].endswith('.pkl'):
+            return pandas.read_pickle(filename).values
+        return np.load(filename, mmap_mode='c')
+
+
+BACKENDS = {
+    'csv': CSVBackend(),
+    'pkl': PickleBackend(),
+    'hdf': HDFBackend(),
+    'hdf-table': HDFTableBackend(),
+    'hdf-table-blosc': HDFTableBackend(complevel=5, complib='blosc'),
+    'npy': NumpyBackend(),
+}
+
+
+def register_backend(storage, backend):
+    '''
+    Register the backend for the given storage name (the value of the
+    --storage argument).
+
+    Args:
+        storage (str):
+            name of the storage
+        backend (proso.geography.cache.Backend):
+            backend handling the storage
+    '''
+    BACKENDS[storage] = backend
+
+
+def backend(storage):
+    if storage not in BACKENDS:
+        raise Exception('There is no cache backend for storage "%s"' % storage)
+    return BACKENDS[storage]
+
+
+def project(dataframe, columns):
+    '''
+    Select the given columns (in the order of the data frame) from the data
+    frame. The columns missing in the data frame are ignored.
+
+    Args:
+        dataframe (pandas.DataFrame):
+            data frame to project
+        columns (list):
+            names of the columns, None means all
+    Returns:
+        pandas.DataFrame
+    '''
+    if columns is None:
+        return dataframe
+    return dataframe[[column for column in dataframe.columns if column in columns]]
+
+
+def array_hash(values):
+    '''
+    Compute a short content hash of the given array, usable as a cache key
+    for data derived from a data frame column.
+
+    Args:
+        values (numpy.ndarray):
+            array of numbers
+    Returns:
+        str: hexadecimal digest
+    '''
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha1(str(values.dtype))
+    digest.update(str(values.shape))
+    digest.update(values.data)
+    return digest.hexdigest()[:16]
+
+
+def file_fingerprint(filename, known=None):
+    '''
+    Compute the fingerprint (size, modification time and content hash) of
+    the given file. The content hash is taken from the known fingerprint when
+    the size and modification time have not changed.
+
+    Args:
+        filename (str):
+            path to the file
+        known (dict, optional):
+            fingerprint recorded before
+    Returns:
+        dict: size, mtime, sha1
+    '''
+    info = stat(filename)
+    fingerprint = {'size': info.st_size, 'mtime': info.st_mtime}
+    if known is not None and known.get('size') == info.st_size and known.get('mtime') == info.st_mtime:
+        fingerprint['sha1'] = known['sha1']
+    else:
+        fingerprint['sha1'] = _content_hash(filename, info)
+    return fingerprint
+
+
+def load_manifest(directory):
+    filename = path.join(directory, MANIFEST_FILE)
+    if not path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    # each process writes its own temporary file, the rename replaces the
+    # manifest atomically, so the readers never see it partially written
+    descriptor, temporary = tempfile.mkstemp(prefix=MANIFEST_FILE + '.', suffix='.tmp', dir=directory)
+    try:
+        with fdopen(descriptor, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        chmod(temporary, 0644)
+        rename(temporary, path.join(directory, MANIFEST_FILE))
+    except Exception:
+        remove(temporary)
+        raise
+
+
+@contextmanager
+def locked_manifest(directory):
+    '''
+    Load the manifest while holding the lock of the given directory and save
+    it on exit, so the processes sharing the directory do not overwrite the
+    entries recorded by each other.
+
+    Args:
+        directory (str):
+            directory containing the cache and its manifest
+    Returns:
+        dict: the manifest, changes to it are saved
+    '''
+    with open(path.join(directory, MANIFEST_LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = load_manifest(directory)
+            yield manifest
+            save_manifest(directory, manifest)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def lookup(directory, name, inputs, params=None):
+    '''
+    Find the valid manifest entry for the given cache name.
+
+    Args:
+        directory (str):
+            directory containing the cache and its manifest
+        name (str):
+            name of the cache entry
+        inputs (list):
+            paths to the input files the entry is computed from
+        params (object, optional):
+            JSON serializable parameters of the entry
+    Returns:
+        dict: manifest entry, or None if the entry is missing or stale
+    '''
+    entry = load_manifest(directory).get(name)
+    if entry is None:
+        return None
+    if entry['version'] != CACHE_VERSION or entry['params'] != params:
+        return None
+    if sorted(entry['inputs'].keys()) != sorted(map(path.abspath, inputs)):
+        return None
+    for filename, known in entry['inputs'].iteritems():
+        if not path.exists(filename):
+            return None
+        info = stat(filename)
+        if info.st_size != known['size']:
+            return None
+        if info.st_mtime != known['mtime'] and _content_hash(filename, info) != known['sha1']:
+            return None
+    return entry
+
+
+def record(directory, name, storage, inputs, params=None, **other):
+    '''
+    Record the cache entry to the manifest.
+
+    Args:
+        directory (str):
+            directory containing the cache and its manifest
+        name (str):
+            name of the cache entry
+        storage (str):
+            storage the entry is written to
+        inputs (list):
+            paths to the input files the entry is computed from
+        params (object, optional):
+            JSON serializable parameters of the entry
+        other:
+            additional JSON serializable information stored to the entry
+    '''
+    manifest = load_manifest(directory)
+    known = {}
+    for entry in manifest.values():
+        known.update(entry['inputs'])
+    entry = dict(other)
+    entry.update({
+        'used': time(),
+        'storage': storage,
+        'version': CACHE_VERSION,
+        'params': params,
+        'inputs': dict([
+            (filename, file_fingerprint(filename, known.get(filename)))
+            for filename in map(path.abspath, inputs)
+        ]),
+    })
+    with locked_manifest(directory) as manifest:
+        manifest[name] = entry
+
+
+def touch(directory, name):
+    '''
+    Mark the cache entry as used now (see evict).
+
+    Args:
+        directory (str):
+            directory containing the cache and its manifest
+        name (str):
+            name of the cache entry
+    '''
+    with locked_manifest(directory) as manifest:
+        if name in manifest:
+            manifest[name]['used'] = time()
+
+
+def evict(directory, prefix, limit):
+    '''
+    Remove the least recently used (written or touched) cache entries having
+    the given name prefix, so at most the given number of them is kept.
+
+    Args:
+        directory (str):
+            directory containing the cache and its manifest
+        prefix (str):
+            name prefix of the entries
+        limit (int):
+            maximal number of the kept entries
+    '''
+    with locked_manifest(directory) as manifest:
+        names = sorted(
+            [name for name in manifest if name.startswith(prefix)],
+            key=lambda name: manifest[name].get('used', 0))
+        removed = names[:max(len(names) - limit, 0)]
+        for name in removed:
+            backend(manifest[name]['storage']).remove(directory, name)
+            del manifest[name]
+    if len(removed) == 0:
+        return
+    print 'cache: %s entries "%s*" removed (the least recently used)' % (len(removed), prefix)
+
+
+def _str2list(value):
+    return [int(item) for item in value.split(',')] if value else []
+
+
+def _content_hash(filename, info):
+    key = (filename, info.st_size, info.st_mtime)
+    if key not in _CONTENT_HASHES:
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), ''):
+                digest.update(chunk)
+        _CONTENT_HASHES[key] = digest.hexdigest()
+    return _CONTENT_HASHES[key]
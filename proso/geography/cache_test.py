@@ -0,0 +1,134 @@
+from multiprocessing import Pool
+import numpy as np
+import os
+import pandas
+import proso.geography.cache as cache
+import shutil
+import tempfile
+import unittest
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, 'input.csv')
+        with open(self.input_file, 'w') as f:
+            f.write('id\n1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        cache.record(self.directory, 'entry', 'csv', [self.input_file], params={'limit': 1})
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file], params={'limit': 1}) is not None)
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file], params={'limit': 2}) is None)
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file, self.directory]) is None)
+        self.assertTrue(cache.lookup(self.directory, 'entry', []) is None)
+        self.assertTrue(cache.lookup(self.directory, 'other', [self.input_file]) is None)
+
+    def test_version(self):
+        cache.record(self.directory, 'entry', 'csv', [self.input_file])
+        with cache.locked_manifest(self.directory) as manifest:
+            manifest['entry']['version'] = cache.CACHE_VERSION - 1
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file]) is None)
+
+    def test_input_changed(self):
+        cache.record(self.directory, 'entry', 'csv', [self.input_file])
+        # the same content written later is still valid
+        _rewrite(self.input_file, 'id\n1\n')
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file]) is not None)
+        # the same size but a different content
+        _rewrite(self.input_file, 'id\n2\n')
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file]) is None)
+        cache.record(self.directory, 'entry', 'csv', [self.input_file])
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file]) is not None)
+        _rewrite(self.input_file, 'id\n2\n3\n')
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file]) is None)
+        os.remove(self.input_file)
+        self.assertTrue(cache.lookup(self.directory, 'entry', [self.input_file]) is None)
+
+    def test_evict(self):
+        frame = pandas.DataFrame({'id': np.arange(3)})
+        for i in range(5):
+            cache.backend('pkl').write(self.directory, 'chain_%s' % i, frame)
+            cache.record(self.directory, 'chain_%s' % i, 'pkl', [self.input_file])
+        cache.record(self.directory, 'other', 'csv', [self.input_file])
+        with cache.locked_manifest(self.directory) as manifest:
+            for i in range(5):
+                manifest['chain_%s' % i]['used'] = i
+        cache.touch(self.directory, 'chain_1')
+        cache.evict(self.directory, 'chain_', 2)
+        manifest = cache.load_manifest(self.directory)
+        self.assertEqual(sorted(manifest.keys()), ['chain_1', 'chain_4', 'other'])
+        for i in range(5):
+            self.assertEqual(cache.backend('pkl').exists(self.directory, 'chain_%s' % i), i in [1, 4])
+
+    def test_concurrent_record(self):
+        pool = Pool(4)
+        try:
+            pool.map(_record_entries, [(self.directory, self.input_file, process) for process in range(4)])
+        finally:
+            pool.close()
+            pool.join()
+        manifest = cache.load_manifest(self.directory)
+        self.assertEqual(len(manifest), 4 * 25)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted([cache.MANIFEST_FILE, cache.MANIFEST_LOCK_FILE, 'input.csv']))
+
+
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frame = pandas.DataFrame({
+            'id': np.arange(1, 6),
+            'user': np.array([3, 3, 5, 7, 7], dtype=np.int64),
+            'inserted': pandas.date_range('2014-10-01', periods=5, freq='H'),
+            'place_map_code': pandas.Categorical(['cz', 'us', 'cz', 'world', 'us']),
+            'place_answered': np.array([1, np.nan, 3, 4, np.nan], dtype=np.float16),
+            'test_id': np.array([np.nan] * 5, dtype=np.float16),
+            'options': [[1, 2], [], [3], [], [4, 5, 6]],
+        })[['id', 'user', 'inserted', 'place_map_code', 'place_answered', 'test_id', 'options']]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for storage in ['pkl', 'hdf', 'hdf-table', 'hdf-table-blosc', 'npy']:
+            backend = cache.backend(storage)
+            backend.write(self.directory, 'answers', self.frame)
+            self.assertTrue(backend.exists(self.directory, 'answers'), storage)
+            read = backend.read(self.directory, 'answers')
+            self.assertEqual(list(read.columns), list(self.frame.columns), storage)
+            for column in self.frame.columns:
+                self.assertEqual(
+                    [str(value) for value in read[column]],
+                    [str(value) for value in self.frame[column]],
+                    '%s: %s' % (storage, column))
+            self.assertEqual(read['place_answered'].dtype, np.float16, storage)
+            self.assertEqual(read['test_id'].dtype, np.float16, storage)
+            projected = backend.read(self.directory, 'answers', columns=['user', 'inserted'])
+            self.assertEqual(list(projected.columns), ['user', 'inserted'], storage)
+            backend.remove(self.directory, 'answers')
+            self.assertFalse(backend.exists(self.directory, 'answers'), storage)
+
+    def test_table_select(self):
+        backend = cache.backend('hdf-table')
+        backend.write(self.directory, 'answers', self.frame)
+        selected = backend.select(self.directory, 'answers', where=['place_map_code == "cz"'], columns=['id'])
+        self.assertEqual(selected['id'].tolist(), [1, 3])
+
+
+def _rewrite(filename, content):
+    mtime = os.stat(filename).st_mtime
+    with open(filename, 'w') as f:
+        f.write(content)
+    os.utime(filename, (mtime + 10, mtime + 10))
+
+
+def _record_entries(arguments):
+    directory, input_file, process = arguments
+    for i in range(25):
+        cache.record(directory, 'entry_%s_%s' % (process, i), 'csv', [input_file])
@@ -1,39 +1,149 @@
 import numpy as np
-import pandas as pd
-from proso.geography.dfutil import iterdicts
+import pandas
+
+
+AB_VALUES_SEPARATOR = ','
+
+# window length of the 'rolling_success' column
+ROLLING_SUCCESS_WINDOW_LENGTH = 10
+
+
+def encode_ab_values(answers):
+    '''
+    Store the A/B values as a categorical column: each distinct set of A/B
+    values is kept only once (its sorted values joined by
+    AB_VALUES_SEPARATOR) and the answers refer to it by an integer code. The
+    answers containing the A/B values as lists (or as the joined strings,
+    e.g. when read from CSV) are converted, the encoded ones are left as they
+    are.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    if 'ab_values' in answers and not _is_categorical(answers['ab_values']):
+        answers['ab_values'] = _ab_values_categorical(answers['ab_values'])
+    return answers
+
+
+def encode_ab_value_pairs(answers, answer_ids, value_ids, values):
+    '''
+    Assign the encoded A/B values (see encode_ab_values) given as pairs
+    (answer id, A/B value id). The set of values of each answer is collected
+    as a bitmask over the used A/B values, so the distinct sets are found
+    without building a list for each answer.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        answer_ids (numpy.ndarray):
+            answer ids of the pairs
+        value_ids (numpy.ndarray):
+            A/B value ids of the pairs
+        values (dict):
+            A/B value id -> A/B value
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    ids = answers['id'].values
+    order = np.argsort(ids, kind='mergesort')
+    positions = np.searchsorted(ids[order], answer_ids)
+    positions[positions == len(ids)] = 0
+    known = ids[order][positions] == answer_ids if len(ids) > 0 else np.zeros(len(answer_ids), dtype=bool)
+    rows = order[positions[known]]
+    table, bits = np.unique(np.asarray(value_ids)[known], return_inverse=True)
+    words = max((len(table) + 63) // 64, 1)
+    masks = np.zeros((len(ids), words), dtype=np.uint64)
+    np.bitwise_or.at(masks, (rows, bits // 64), np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+    keys = masks.view(np.dtype((np.void, masks.itemsize * words))).ravel()
+    _, first, codes = np.unique(keys, return_index=True, return_inverse=True)
+    categories = []
+    for mask in masks[first]:
+        used = [
+            values[table[bit]]
+            for bit in range(len(table))
+            if mask[bit // 64] & np.left_shift(np.uint64(1), np.uint64(bit % 64))
+        ]
+        categories.append(AB_VALUES_SEPARATOR.join(sorted(used)))
+    answers['ab_values'] = pandas.Categorical.from_codes(codes, categories)
+    return answers
+
+
+def ab_values_mask(answers, predicate):
+    '''
+    Evaluate the given predicate on the A/B values of each answer. The
+    predicate is called only once for each distinct set of A/B values.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        predicate (function):
+            list of A/B values -> bool
+    Returns:
+        numpy.ndarray: boolean array aligned with the answers
+    '''
+    codes, categories = _ab_values_codes(answers)
+    return np.array(map(predicate, categories), dtype=bool)[codes]
 
 
 def interested_ab_values(answers, group_prefixes, override=False):
     if not override and 'interested_ab_values' in answers:
         return answers
-
-    answers['interested_ab_values'] = (
-        answers['ab_values'].
-        apply(lambda values: '__'.join(sorted(filter_ab_values_by_prefix(values, group_prefixes))))
-    )
+    codes, categories = _ab_values_codes(answers)
+    labels = np.array(
+        ['__'.join(sorted(filter_ab_values_by_prefix(values, group_prefixes))) for values in categories],
+        dtype=object)
+    uniques, inverse = np.unique(labels, return_inverse=True)
+    answers['interested_ab_values'] = pandas.Categorical.from_codes(inverse[codes], uniques)
     return answers
 
 
 def success_before(feedback, answers, override=False):
+    '''
+    Assign the user's success rate on the answers inserted before the given
+    feedback, rounded to multiples of 5 percent.
+
+    Args:
+        feedback (pandas.DataFrame):
+            data frame containing feedback data
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        override (bool, optional, default False):
+            if False and the feedback contains 'success_before' column
+            already, the decoration will be skipped.
+    Returns:
+        pandas.DataFrame: data frame containing feedback data
+    '''
     if len(feedback) == 0:
         return feedback
     if not override and 'success_before' in feedback:
         return feedback
     feedback.sort(['user', 'id'], inplace=True)
-    last_user = None
-    user_data = None
-    last_date = None
-    success_before_dict = {}
-    for row in iterdicts(feedback):
-        if row['user'] != last_user:
-            last_user = row['user']
-            last_date = None
-            user_data = answers[answers['user'] == last_user]
-        filter_fun = lambda x: x['inserted'] < row['inserted'] and (last_date is None or x['inserted'] > last_date)
-        interval_data = user_data[user_data.apply(filter_fun, axis=1)]
-        prob = sum(interval_data['place_asked'] == interval_data['place_answered']) / float(len(interval_data))
-        success_before_dict[row['id']] = int(5 * round(float(prob * 100) / 5))
-    feedback['success_before'] = feedback.apply(lambda x: success_before_dict[x['id']], axis=1)
+    answers = answers[answers['user'].isin(feedback['user'].unique())]
+    feedback_len = len(feedback)
+    # feedback and answers are merged to one sequence ordered by user and
+    # time, the feedback goes before the answers inserted at the same time
+    users = np.concatenate([feedback['user'].values, answers['user'].values])
+    inserted = np.concatenate([feedback['inserted'].values, answers['inserted'].values])
+    is_answer = np.zeros(len(users), dtype=np.int64)
+    is_answer[feedback_len:] = 1
+    is_correct = np.zeros(len(users), dtype=np.int64)
+    is_correct[feedback_len:] = answers['place_asked'].values == answers['place_answered'].values
+    order = np.lexsort((is_answer, inserted, users))
+    user_start = _user_starts(users[order])
+    answers_before = _cumsum_within(is_answer[order], user_start)
+    correct_before = _cumsum_within(is_correct[order], user_start)
+    position = np.empty(len(users), dtype=np.int64)
+    position[order] = np.arange(len(users))
+    position = position[:feedback_len]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prob = correct_before[position] / answers_before[position].astype(np.float64)
+    success = 5 * np.floor(prob * 100 / 5 + 0.5)
+    if np.isfinite(success).all():
+        success = success.astype(np.int64)
+    feedback['success_before'] = success
     return feedback
 
 
@@ -59,17 +169,130 @@ def ab_group(answers, group_prefixes, override=False):
         for prefix in prefixes:
             name = name.replace(prefix, "")
         return name
-    uniques = answers['interested_ab_values'].unique()
+    values = answers['interested_ab_values'].values
+    if isinstance(values, pandas.Categorical):
+        groups, uniques = pandas.factorize(values.codes)
+        uniques = values.categories.values[uniques]
+    else:
+        groups, uniques = pandas.factorize(values)
     mapping = dict(zip(
         range(len(uniques)),
         map(lambda x: drop_prefixes(x, group_prefixes), uniques)))
-    mapping_reverse = dict(zip(
-        uniques,
-        range(len(uniques))))
-    answers['ab_group'] = answers['interested_ab_values'].apply(lambda x: mapping_reverse[x])
+    answers['ab_group'] = groups
     return answers, mapping
 
 
+def decorate(answers, columns=None, override=False, **options):
+    '''
+    Assign all the per-user sequential columns (session number, last in
+    session marker, rolling success and the registered ones) in one pass. The
+    answers are ordered by user and id only once and every column is computed
+    from the ordered numpy arrays.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        columns (list, optional):
+            names of the columns to compute, all registered columns by default
+        override (bool, optional, default False):
+            if False, the columns the data already contains are skipped
+        options:
+            keyword arguments passed to the column kernels, e.g.
+            delta_in_seconds or window_length
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    if columns is None:
+        columns = [name for name, _ in _SEQUENTIAL_COLUMNS]
+    if not override:
+        columns = [name for name in columns if name not in answers]
+    if len(columns) == 0:
+        return answers
+    kernels = []
+    for name, kernel in _SEQUENTIAL_COLUMNS:
+        if name in columns:
+            kernels.append((name, kernel))
+        elif name in answers:
+            kernels.append((name, None))
+    return _decorate(answers, kernels, **options)
+
+
+def redecorate(answers, users, **options):
+    '''
+    Recompute the sequential columns the data already contains only for the
+    given users, e.g. for the users whose answers were partially filtered
+    out. The values of the other users are kept.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        users (list):
+            ids of the users whose columns are recomputed
+        options:
+            keyword arguments passed to the column kernels, e.g.
+            delta_in_seconds or window_length
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    kernels = [(name, kernel) for name, kernel in _SEQUENTIAL_COLUMNS if name in answers]
+    if len(users) == 0 or len(kernels) == 0:
+        return answers
+    changed = np.in1d(answers['user'].values, users)
+    if changed.all():
+        return _decorate(answers, kernels, **options)
+    data = answers.copy()
+    for name, values in _decorate_columns(answers[changed], kernels, **options):
+        column = data[name].values.copy()
+        column[changed] = values
+        data[name] = column
+    return data
+
+
+def register_sequential_column(name, kernel):
+    '''
+    Register a new column computed by the decorate function.
+
+    Args:
+        name (str):
+            name of the column
+        kernel (function):
+            function taking a dict of numpy arrays ordered by user and id
+            ('user', 'id', 'inserted', 'correct', 'user_start' and the columns
+            registered before) and the keyword options of the decorate
+            function, returning numpy array with the column values
+    '''
+    _SEQUENTIAL_COLUMNS[:] = [(n, k) for (n, k) in _SEQUENTIAL_COLUMNS if n != name]
+    _SEQUENTIAL_COLUMNS.append((name, kernel))
+
+
+def rolling_success_bank(answers, window_lengths=None, override=False):
+    '''
+    Assign the rolling success for several window lengths at once. For each
+    window length the column 'rolling_success_<window length>' is created.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        window_lengths (list, optional, default [5, 10, 20]):
+            sizes of the windows
+        override (bool, optional, default False):
+            if False, the windows the data already contains columns for are
+            skipped
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    if window_lengths is None:
+        window_lengths = [5, 10, 20]
+    kernels = [('session_number', None if 'session_number' in answers else _session_number_column)]
+    for window_length in window_lengths:
+        name = 'rolling_success_%s' % window_length
+        if override or name not in answers:
+            kernels.append((name, _rolling_success_window(window_length)))
+    if len(kernels) == 1:
+        return answers
+    return _decorate(answers, kernels)
+
+
 def session_number(answers, delta_in_seconds=1800, override=False):
     '''
     Assign session number to every answer.
@@ -87,11 +310,7 @@ def session_number(answers, delta_in_seconds=1800, override=False):
     '''
     if not override and 'session_number' in answers:
         return answers
-    return (answers.
-        sort(['user', 'id']).
-        groupby('user').
-        apply(lambda x: _session_number_for_user(x, delta_in_seconds)).
-        sort())
+    return decorate(answers, ['session_number'], override=True, delta_in_seconds=delta_in_seconds)
 
 
 def last_in_session(answers, override=False):
@@ -110,14 +329,35 @@ def last_in_session(answers, override=False):
     '''
     if not override and 'last_in_session' in answers:
         return answers
-    if 'session_number' in answers:
-        data = answers
-    else:
-        data = session_number(answers)
-    return (data.
-        groupby('user').
-        apply(_last_in_session_for_user).
-        sort())
+    columns = ['last_in_session']
+    if 'session_number' not in answers:
+        columns.append('session_number')
+    return decorate(answers, columns, override=True)
+
+
+def rolling_success_column(answers, window_length=10):
+    '''
+    Find the column containing the rolling success for the given window
+    length. The 'rolling_success' column the answers are decorated by (see
+    decorate) is used for the default window (10 answers), the other windows
+    are computed by rolling_success_bank unless the data already contains
+    them.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        window_length (int, optional):
+            size of the window
+    Returns:
+        (pandas.DataFrame, str): data frame containing answer data and the
+        name of the column
+    '''
+    column = 'rolling_success_%s' % window_length
+    if column in answers:
+        return answers, column
+    if window_length == ROLLING_SUCCESS_WINDOW_LENGTH and 'rolling_success' in answers:
+        return answers, 'rolling_success'
+    return rolling_success_bank(answers, [window_length]), column
 
 
 def rolling_success(answers, window_length=10, override=False):
@@ -138,34 +378,164 @@ def rolling_success(answers, window_length=10, override=False):
     '''
     if not override and 'rolling_success' in answers:
         return answers
-    if 'last_in_session' in answers:
-        data = answers
-    else:
-        data = last_in_session(answers)
-    return (data.
-        groupby(['user', 'session_number']).
-        apply(lambda x: _rolling_succcess_for_user_session(x, window_length)).
-        sort())
+    columns = ['rolling_success']
+    if 'last_in_session' not in answers:
+        columns += ['session_number', 'last_in_session']
+    return decorate(answers, columns, override=True, window_length=window_length)
 
 
-def _last_in_session_for_user(group):
-    data = group.sort(['session_number', 'id'])
-    data['last_in_session'] = data['session_number'] != data.shift(-1)['session_number']
+def _decorate(answers, kernels, **options):
+    data = answers.copy()
+    for name, values in _decorate_columns(answers, kernels, **options):
+        data[name] = values
+    if not data.index.is_monotonic:
+        data = data.sort()
     return data
 
 
-def _rolling_succcess_for_user_session(group, window_length):
-    group['rolling_success'] = pd.rolling_apply(
-        group['place_asked'] == group['place_answered'],
-        window_length,
-        lambda x: sum(x) / float(window_length))
-    return group
+def _decorate_columns(answers, kernels, **options):
+    order = np.lexsort((answers['id'].values, answers['user'].values))
+    arrays = {
+        'user': answers['user'].values[order],
+        'id': answers['id'].values[order],
+        'inserted': answers['inserted'].values[order],
+        'correct': (answers['place_asked'].values == answers['place_answered'].values)[order],
+    }
+    arrays['user_start'] = _user_starts(arrays['user'])
+    computed = []
+    for name, kernel in kernels:
+        if kernel is None:
+            arrays[name] = answers[name].values[order]
+        else:
+            arrays[name] = kernel(arrays, **options)
+            computed.append(name)
+    result = []
+    for name in computed:
+        values = np.empty_like(arrays[name])
+        values[order] = arrays[name]
+        result.append((name, values))
+    return result
+
+
+def _user_starts(users):
+    starts = np.ones(len(users), dtype=bool)
+    starts[1:] = users[1:] != users[:-1]
+    return starts
+
+
+def _cumsum_within(values, starts):
+    total = np.cumsum(values)
+    exclusive = total - values
+    return total - np.maximum.accumulate(np.where(starts, exclusive, 0))
+
+
+def _session_starts(arrays):
+    if 'session_start' not in arrays:
+        starts = arrays['user_start'].copy()
+        starts[1:] |= arrays['session_number'][1:] != arrays['session_number'][:-1]
+        arrays['session_start'] = starts
+    return arrays['session_start']
+
+
+def _session_number_kernel(users, inserted, delta_in_seconds):
+    """
+    Computes session numbers for answers already sorted by user and id. The
+    first answer of each user starts the session 0 and every gap longer than
+    the given delta starts a new session.
+
+    Args:
+        users (numpy.ndarray):
+            user's ids of the sorted answers
+        inserted (numpy.ndarray):
+            datetime64 values of the sorted answers
+        delta_in_seconds (int):
+            maximal time gap between 2 answers to be marked in the same session
+    Returns:
+        numpy.ndarray: session numbers
+    """
+    if len(users) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = _user_starts(users)
+    new_session = np.zeros(len(users), dtype=bool)
+    new_session[1:] = (inserted[1:] - inserted[:-1]) > np.timedelta64(delta_in_seconds, 's')
+    new_session[starts] = False
+    total = np.cumsum(new_session)
+    return total - np.maximum.accumulate(np.where(starts, total, 0))
+
+
+def _session_number_column(arrays, delta_in_seconds=1800, **options):
+    return _session_number_kernel(arrays['user'], arrays['inserted'], delta_in_seconds)
+
+
+def _last_in_session_column(arrays, **options):
+    last = np.ones(len(arrays['user']), dtype=bool)
+    last[:-1] = _session_starts(arrays)[1:]
+    return last
+
+
+def _rolling_success_column(arrays, window_length=ROLLING_SUCCESS_WINDOW_LENGTH, **options):
+    return _rolling_success_kernel(arrays['correct'], _session_starts(arrays), window_length)
+
+
+def _rolling_success_window(window_length):
+    return lambda arrays, **options: _rolling_success_column(arrays, window_length=window_length)
+
+
+def _rolling_success_kernel(correct, session_starts, window_length):
+    """
+    Computes the rolling success from the cumulative sum of the correct
+    answers. The value is NaN for the first (window_length - 1) answers of
+    each session.
+
+    Args:
+        correct (numpy.ndarray):
+            boolean markers of the correct answers ordered by user and id
+        session_starts (numpy.ndarray):
+            boolean markers of the first answers in session
+        window_length (int):
+            size of the window
+    Returns:
+        numpy.ndarray: rolling success
+    """
+    positions = np.arange(len(correct))
+    position_in_session = positions - np.maximum.accumulate(
+        np.where(session_starts, positions, 0))
+    total = np.zeros(len(correct) + 1, dtype=np.int64)
+    np.cumsum(correct, out=total[1:])
+    result = np.empty(len(correct), dtype=np.float64)
+    result.fill(np.nan)
+    valid = position_in_session >= window_length - 1
+    ends = positions[valid] + 1
+    result[valid] = (total[ends] - total[ends - window_length]) / float(window_length)
+    return result
+
+
+def _is_categorical(column):
+    return isinstance(column.values, pandas.Categorical)
+
+
+def _ab_values_categorical(column):
+    def _key(values):
+        if isinstance(values, list):
+            return AB_VALUES_SEPARATOR.join(sorted(values))
+        if isinstance(values, basestring):
+            return values
+        return ''
+    return pandas.Categorical(map(_key, column.values))
+
+
+def _ab_values_codes(answers):
+    column = answers['ab_values']
+    column = column.values if _is_categorical(column) else _ab_values_categorical(column)
+    categories = [
+        category.split(AB_VALUES_SEPARATOR) if category else []
+        for category in column.categories
+    ]
+    return column.codes, categories
 
 
-def _session_number_for_user(group, delta_in_seconds):
-    session_duration = np.timedelta64(delta_in_seconds, 's')
-    group['session_number'] = (
-        (group['inserted'] - group['inserted'].shift(1) > session_duration).
-        fillna(1).
-        cumsum())
-    return group
+_SEQUENTIAL_COLUMNS = [
+    ('session_number', _session_number_column),
+    ('last_in_session', _last_in_session_column),
+    ('rolling_success', _rolling_success_column),
+]
@@ -0,0 +1,28 @@
+import pandas
+import proso.geography.decorator as decorator
+import proso.geography.testing as testing
+import unittest
+
+
+class RollingSuccessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.answers = decorator.decorate(testing.random_answers(n=2000))
+
+    def test_stored_column_for_default_window(self):
+        # the answers filtered after the decoration keep the rolling success
+        # computed from all the answers
+        filtered = self.answers[self.answers['inserted'] >= pandas.Timestamp('2014-10-03')]
+        data, column = decorator.rolling_success_column(filtered, 10)
+        self.assertEqual(column, 'rolling_success')
+        self.assertTrue(data is filtered)
+
+    def test_other_windows_computed(self):
+        data, column = decorator.rolling_success_column(self.answers, 5)
+        self.assertEqual(column, 'rolling_success_5')
+        expected = decorator.rolling_success(self.answers.drop('rolling_success', axis=1), window_length=5)
+        self.assertTrue(pandas.Series(data[column].values).equals(pandas.Series(expected['rolling_success'].values)))
+
+    def test_bank_matches_default_window(self):
+        data = decorator.rolling_success_bank(self.answers, [10])
+        self.assertTrue(pandas.Series(data['rolling_success_10'].values).equals(pandas.Series(data['rolling_success'].values)))
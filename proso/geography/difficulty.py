@@ -3,9 +3,17 @@ from proso.geography.environment import InMemoryEnvironment
 from proso.geography.answers import first_answers
 from proso.geography.dfutil import iterdicts
 from proso.geography.model import predict_simple
+import elo
+import multiprocessing
+import numpy as np
 import pandas
 
 
+# answer arrays and variants shared with the worker processes by
+# prepare_variants
+_VARIANTS = None
+
+
 def difficulty_to_dataframe(difficulty):
     return pandas.DataFrame(difficulty.items()).rename(
         columns={0: 'place', 1: 'difficulty'}
@@ -16,16 +24,31 @@ def dataframe_to_difficulty(dataframe):
     return dataframe.set_index('place')['difficulty'].to_dict()
 
 
-def prepare_difficulty_and_prior_skill(answers, difficulty=None):
+ENGINES = ['stream', 'array']
+
+
+def prepare_difficulty_and_prior_skill(answers, difficulty=None, engine='array'):
     '''
     Compute the difficulty for places.
 
     Args:
         answers (pandas.DataFrame):
             data frame containing answer data
+        difficulty (dict, optional):
+            place -> difficulty, if given, the difficulty is preserved
+        engine (str, optional):
+            'stream' streams the answers through the model and environment
+            objects, 'array' replays them over numpy arrays (see
+            proso.geography.elo), both give the same estimates
     Returns:
         dict: place -> difficulty, user's id -> prior skill
     '''
+    if engine not in ENGINES:
+        raise Exception('There is no engine "%s" to compute the difficulty' % engine)
+    if engine == 'array':
+        first = answers.sort('id').drop_duplicates(['user', 'place_asked'])
+        difficulty, skills = elo.estimate(first, difficulty)
+        return difficulty, _prior_skill_probabilities(skills.items())
     first = first_answers(answers, ['user']).sort('id').sort('id')
     if difficulty:
         env = PreserveDifficultyEnvironment(difficulty)
@@ -34,10 +57,142 @@ def prepare_difficulty_and_prior_skill(answers, difficulty=None):
     stream = DefaultAnswerStream(env)
     for a in iterdicts(first):
         stream.stream_answer(a)
-    skill_items = env.export_prior_skill().items()
-    ids, skills = zip(*skill_items)
-    prior_skill = dict(zip(list(ids), map(lambda x: predict_simple(x, 0)[0], list(skills))))
-    return env.export_difficulty(), prior_skill
+    return env.export_difficulty(), _prior_skill_probabilities(env.export_prior_skill().items())
+
+
+def prepare_variants(answers, variants, difficulty=None, processes=None):
+    '''
+    Compute the difficulty and prior skill for several variants of the model
+    (parameters, subsets of the answers) at once. The answers are converted
+    to arrays only once and the variants are replayed in a process pool,
+    the workers share the arrays (they are inherited, not copied, by the
+    forked processes).
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        variants (dict):
+            name -> variant, the variant is a dict with optional keys
+            'params' (parameters of the model, see
+            proso.geography.elo.DEFAULT_PARAMS), 'filter' (column -> list of
+            values, only the answers with these values are used, e.g.
+            {'place_map_code': ['cz']}) and 'preserve_difficulty' (if True,
+            the given difficulty is preserved)
+        difficulty (dict, optional):
+            place -> difficulty preserved by the variants asking for it
+        processes (int, optional):
+            number of worker processes, by default the number of CPUs
+    Returns:
+        dict: name -> (dict: place -> difficulty, dict: user's id -> prior skill)
+    '''
+    global _VARIANTS
+    answers = answers.sort('id')
+    rows = {}
+    for name, variant in variants.iteritems():
+        if variant.get('preserve_difficulty') and not difficulty:
+            raise Exception('The variant "%s" preserves the difficulty, but no difficulty is given' % name)
+        mask = np.ones(len(answers), dtype=bool)
+        for column, values in sorted(variant.get('filter', {}).items()):
+            mask &= answers[column].isin(values).values
+        rows[name] = mask
+    _VARIANTS = (elo.answer_arrays(answers), variants, rows, difficulty)
+    try:
+        names = sorted(variants.keys())
+        if processes == 1 or len(names) < 2:
+            results = map(_prepare_variant, names)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_prepare_variant, names, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _VARIANTS = None
+    return dict(zip(names, results))
+
+
+def prepare_checkpoint(answers, checkpoint=None):
+    '''
+    Compute the state of the model (difficulty of places, prior skill of
+    users and the data needed to continue) for the given answers. If the
+    checkpoint computed from the previous data is given, only the answers
+    newer than the checkpoint are replayed, the result is the same as when
+    computed from all the answers.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        checkpoint (dict, optional):
+            checkpoint computed from the previous data (see
+            proso.geography.elo.checkpoint)
+    Returns:
+        dict: checkpoint
+    '''
+    first = answers.sort('id')
+    if checkpoint is not None:
+        first = first[first['id'] > checkpoint['last_id']]
+    first = first.drop_duplicates(['user', 'place_asked'])
+    if checkpoint is not None and len(first) > 0:
+        known = pandas.MultiIndex.from_arrays([checkpoint['pairs']['user'].values, checkpoint['pairs']['place'].values])
+        first = first[~pandas.MultiIndex.from_arrays([first['user'].values, first['place_asked'].values]).isin(known)]
+    return elo.checkpoint(first, checkpoint)
+
+
+def checkpoint_to_difficulty_and_prior_skill(checkpoint):
+    '''
+    Args:
+        checkpoint (dict):
+            checkpoint (see prepare_checkpoint)
+    Returns:
+        dict: place -> difficulty, user's id -> prior skill
+    '''
+    difficulty, skills = elo.checkpoint_estimates(checkpoint)
+    return difficulty, _prior_skill_probabilities(skills.items())
+
+
+def prepare_prior_skill_by_group(answers, difficulty, group_column):
+    '''
+    Compute the prior skill of users for each group of answers (e.g. session
+    number) independently, with the given difficulty of places preserved. The
+    result is the same as calling prepare_difficulty_and_prior_skill for each
+    group, but all the groups are replayed at once: with the difficulty
+    fixed the state of the model depends only on the group and the user, so
+    it is kept for these pairs.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        difficulty (dict):
+            place -> difficulty
+        group_column (str):
+            column the answers are grouped by
+    Returns:
+        dict: group -> (dict: user's id -> prior skill)
+    '''
+    first = answers.sort('id').drop_duplicates([group_column, 'user', 'place_asked'])
+    groups, group_codes = np.unique(first[group_column].values, return_inverse=True)
+    users, user_codes = np.unique(first['user'].values, return_inverse=True)
+    pairs = group_codes.astype(np.int64) * len(users) + user_codes
+    skills = elo.estimate(first, difficulty, users=pairs)[1]
+    groups, users = groups.tolist(), users.tolist()
+    result = {}
+    for pair, skill in skills.iteritems():
+        result.setdefault(groups[pair // len(users)], {})[users[pair % len(users)]] = predict_simple(skill, 0)[0]
+    return result
+
+
+def _prior_skill_probabilities(skill_items):
+    return dict([(i, predict_simple(skill, 0)[0]) for i, skill in skill_items])
+
+
+def _prepare_variant(name):
+    arrays, variants, rows, difficulty = _VARIANTS
+    variant = variants[name]
+    place_difficulty, skills = elo.estimate_arrays(
+        arrays, rows[name], difficulty if variant.get('preserve_difficulty') else None,
+        **variant.get('params', {}))
+    return place_difficulty, _prior_skill_probabilities(skills.items())
 
 
 class DefaultAnswerStream(AnswerStream):
@@ -0,0 +1,413 @@
+"""
+Array backed replay of the first answers through the default prior/current
+model (see proso.geography.model.DefaultModel). The users and places get
+dense codes, their parameters are held in numpy arrays and the answers are
+processed in one loop, so the estimates are the same as the ones computed by
+streaming the answers through the model and the in-memory environment. The
+loop is compiled by Cython (module _elo, built by setup.py when Cython is
+available), otherwise its pure Python version is used.
+"""
+
+from proso.geography.model import predict
+import ids
+import numpy as np
+import pandas
+
+try:
+    import _elo
+except ImportError:
+    _elo = None
+
+
+DEFAULT_PARAMS = {
+    'elo_alpha': 1.0,
+    'elo_alpha_dynamic': 0.05,
+    'pfae_good': 3.4,
+    'pfae_bad': 0.3,
+    'time_shift': 80.0,
+}
+
+# seconds since the last answer used when the place has not been answered
+NEVER_SECONDS = 315360000.0
+
+
+def estimate(first, difficulty=None, users=None, **params):
+    '''
+    Estimate the difficulty of places and the prior skill of users from the
+    given first answers.
+
+    Args:
+        first (pandas.DataFrame):
+            data frame containing first answers sorted by id
+        difficulty (dict, optional):
+            place -> difficulty, if given, the difficulty is preserved and
+            only the prior skill is estimated
+        users (numpy.ndarray, optional):
+            key of the user's state for each answer (e.g. user and group
+            pairs), by default the 'user' column is used
+        params:
+            parameters of the model overriding DEFAULT_PARAMS
+    Returns:
+        dict: place -> difficulty, user's key -> prior skill (not transformed
+        to the probability)
+    '''
+    if users is None:
+        users = first['user'].values
+    user_ids, user_codes = np.unique(users, return_inverse=True)
+    offsets, option_places = _options(first)
+    place_ids, place_codes = np.unique(
+        np.concatenate([first['place_asked'].values, option_places]), return_inverse=True)
+    asked_codes = place_codes[:len(first)]
+    state = new_state(len(user_ids), len(place_ids), len(first))
+    if difficulty:
+        state['difficulty'][:] = [difficulty.get(p, 0) for p in place_ids.tolist()]
+    replay(
+        user_codes, asked_codes, _correct(first), offsets, place_codes[len(first):],
+        _inserted(first), state, update_difficulty=not difficulty, **params)
+    if difficulty:
+        place_difficulty = difficulty
+    else:
+        answered = np.unique(asked_codes)
+        place_difficulty = dict(zip(place_ids[answered].tolist(), state['difficulty'][answered].tolist()))
+    return place_difficulty, dict(zip(user_ids.tolist(), state['prior_skill'].tolist()))
+
+
+def answer_arrays(answers):
+    '''
+    Convert the answers to the arrays the replay runs over, so they can be
+    shared by several replays (e.g. of subsets of the answers or with
+    different parameters).
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data sorted by id
+    Returns:
+        dict: arrays aligned with the answers 'users', 'places' (codes of the
+        user and the asked place), 'correct', 'inserted', 'offsets' and
+        'options' (codes of the options, see replay) and the lookup tables
+        'user_ids', 'place_ids' (code -> id)
+    '''
+    offsets, option_places = _options(answers)
+    user_ids, user_codes = np.unique(answers['user'].values, return_inverse=True)
+    place_ids, place_codes = np.unique(
+        np.concatenate([answers['place_asked'].values, option_places]), return_inverse=True)
+    return {
+        'users': user_codes.astype(np.int64),
+        'places': place_codes[:len(answers)].astype(np.int64),
+        'correct': _correct(answers),
+        'inserted': _inserted(answers),
+        'offsets': offsets,
+        'options': place_codes[len(answers):].astype(np.int64),
+        'user_ids': user_ids,
+        'place_ids': place_ids,
+    }
+
+
+def estimate_arrays(arrays, rows=None, difficulty=None, **params):
+    '''
+    Estimate the difficulty of places and the prior skill of users from the
+    first answers among the given rows of the answer arrays.
+
+    Args:
+        arrays (dict):
+            answer arrays, see answer_arrays
+        rows (numpy.ndarray, optional):
+            bool mask of the answers to use, by default all the answers are
+            used
+        difficulty (dict, optional):
+            place -> difficulty, if given, the difficulty is preserved and
+            only the prior skill is estimated
+        params:
+            parameters of the model overriding DEFAULT_PARAMS
+    Returns:
+        dict: place -> difficulty, user's id -> prior skill (not transformed
+        to the probability)
+    '''
+    place_ids, user_ids = arrays['place_ids'], arrays['user_ids']
+    rows = np.arange(len(arrays['users'])) if rows is None else np.flatnonzero(rows)
+    keys = arrays['users'][rows] * len(place_ids) + arrays['places'][rows]
+    first = rows[np.sort(np.unique(keys, return_index=True)[1])]
+    lengths = np.diff(arrays['offsets'])[first]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    entries = np.repeat(arrays['offsets'][first] - offsets[:-1], lengths) + np.arange(offsets[-1])
+    state = new_state(len(user_ids), len(place_ids), len(first))
+    if difficulty:
+        state['difficulty'][:] = [difficulty.get(p, 0) for p in place_ids.tolist()]
+    replay(
+        arrays['users'][first], arrays['places'][first], arrays['correct'][first], offsets,
+        arrays['options'][entries], arrays['inserted'][first], state,
+        update_difficulty=not difficulty, **params)
+    active = state['user_answers'] > 0
+    prior_skill = dict(zip(user_ids[active].tolist(), state['prior_skill'][active].tolist()))
+    if difficulty:
+        return difficulty, prior_skill
+    answered = state['place_answers'] > 0
+    return dict(zip(place_ids[answered].tolist(), state['difficulty'][answered].tolist())), prior_skill
+
+
+def checkpoint(first, previous=None, **params):
+    '''
+    Replay the given first answers starting from the state saved in the
+    previous checkpoint. The result is the same as replaying all the first
+    answers at once, so a new data dump needs only its new answers replayed.
+
+    Args:
+        first (pandas.DataFrame):
+            data frame containing first answers sorted by id, which are newer
+            than the previous checkpoint and whose (user, place) pairs are not
+            in it
+        previous (dict, optional):
+            checkpoint to start from, by default the replay starts from
+            scratch
+        params:
+            parameters of the model overriding DEFAULT_PARAMS
+    Returns:
+        dict: checkpoint, i.e. 'places' (place, difficulty, answers),
+        'users' (user, prior_skill, answers), 'pairs' (user, place,
+        current_skill, last_time in nanoseconds) data frames and 'last_id'
+        (the id of the last replayed answer)
+    '''
+    if previous is None:
+        previous = empty_checkpoint()
+    places, users, pairs = previous['places'], previous['users'], previous['pairs']
+    offsets, option_places = _options(first)
+    user_ids = np.unique(np.concatenate([users['user'].values, first['user'].values]))
+    place_ids = np.unique(np.concatenate([
+        places['place'].values, first['place_asked'].values, option_places]))
+    state = new_state(len(user_ids), len(place_ids), len(pairs) + len(first))
+    known_users = ids.codes(users['user'].values, user_ids)
+    state['prior_skill'][known_users] = users['prior_skill'].values
+    state['user_answers'][known_users] = users['answers'].values
+    known_places = ids.codes(places['place'].values, place_ids)
+    state['difficulty'][known_places] = places['difficulty'].values
+    state['place_answers'][known_places] = places['answers'].values
+    state['current_skill'][:len(pairs)] = pairs['current_skill'].values
+    pair_users = np.concatenate([pairs['user'].values, first['user'].values])
+    pair_places = np.concatenate([pairs['place'].values, first['place_asked'].values])
+    inserted = np.concatenate([pairs['last_time'].values, _inserted(first)])
+    replay(
+        ids.codes(pair_users, user_ids),
+        ids.codes(pair_places, place_ids),
+        np.concatenate([np.zeros(len(pairs), dtype=bool), _correct(first)]),
+        np.concatenate([np.zeros(len(pairs), dtype=np.int64), offsets]),
+        ids.codes(option_places, place_ids),
+        inserted, state, start=len(pairs), **params)
+    answered = state['place_answers'] > 0
+    active = state['user_answers'] > 0
+    return {
+        'places': pandas.DataFrame({
+            'place': place_ids[answered],
+            'difficulty': state['difficulty'][answered],
+            'answers': state['place_answers'][answered],
+        })[['place', 'difficulty', 'answers']],
+        'users': pandas.DataFrame({
+            'user': user_ids[active],
+            'prior_skill': state['prior_skill'][active],
+            'answers': state['user_answers'][active],
+        })[['user', 'prior_skill', 'answers']],
+        'pairs': pandas.DataFrame({
+            'user': pair_users,
+            'place': pair_places,
+            'current_skill': state['current_skill'],
+            'last_time': inserted,
+        })[['user', 'place', 'current_skill', 'last_time']],
+        'last_id': max([previous['last_id']] + first['id'].values[-1:].tolist()),
+    }
+
+
+def checkpoint_estimates(checkpoint):
+    '''
+    Get the estimates saved in the given checkpoint.
+
+    Args:
+        checkpoint (dict):
+            checkpoint, see checkpoint()
+    Returns:
+        dict: place -> difficulty, user's id -> prior skill (not transformed
+        to the probability)
+    '''
+    return (
+        dict(zip(checkpoint['places']['place'].tolist(), checkpoint['places']['difficulty'].tolist())),
+        dict(zip(checkpoint['users']['user'].tolist(), checkpoint['users']['prior_skill'].tolist())),
+    )
+
+
+def empty_checkpoint():
+    return {
+        'places': pandas.DataFrame({
+            'place': np.array([], dtype=np.int64),
+            'difficulty': np.array([], dtype=np.float64),
+            'answers': np.array([], dtype=np.int64),
+        })[['place', 'difficulty', 'answers']],
+        'users': pandas.DataFrame({
+            'user': np.array([], dtype=np.int64),
+            'prior_skill': np.array([], dtype=np.float64),
+            'answers': np.array([], dtype=np.int64),
+        })[['user', 'prior_skill', 'answers']],
+        'pairs': pandas.DataFrame({
+            'user': np.array([], dtype=np.int64),
+            'place': np.array([], dtype=np.int64),
+            'current_skill': np.array([], dtype=np.float64),
+            'last_time': np.array([], dtype=np.int64),
+        })[['user', 'place', 'current_skill', 'last_time']],
+        'last_id': 0,
+    }
+
+
+def new_state(n_users, n_places, n_answers):
+    '''
+    Create the initial state of the replay.
+
+    Returns:
+        dict: numpy arrays 'prior_skill', 'user_answers' (the number of first
+        answers) indexed by the user's code, 'difficulty', 'place_answers'
+        indexed by the place's code and 'current_skill' indexed by the answer
+    '''
+    return {
+        'prior_skill': np.zeros(n_users, dtype=np.float64),
+        'user_answers': np.zeros(n_users, dtype=np.int64),
+        'difficulty': np.zeros(n_places, dtype=np.float64),
+        'place_answers': np.zeros(n_places, dtype=np.int64),
+        'current_skill': np.zeros(n_answers, dtype=np.float64),
+    }
+
+
+def replay(users, places, correct, offsets, options, inserted, state, start=0,
+        update_difficulty=True, **params):
+    '''
+    Replay the first answers given as arrays ordered by time.
+
+    Args:
+        users (numpy.ndarray):
+            code of the user for each answer
+        places (numpy.ndarray):
+            code of the asked place for each answer
+        correct (numpy.ndarray):
+            bool correctness of each answer
+        offsets (numpy.ndarray):
+            offsets of each answer's options, the options of the i-th answer
+            are options[offsets[i]:offsets[i + 1]]
+        options (numpy.ndarray):
+            codes of the options (the asked place alone for the open
+            questions)
+        inserted (numpy.ndarray):
+            int64 time of each answer in nanoseconds
+        state (dict):
+            state of the replay (see new_state), it is updated in place
+        start (int, optional):
+            the answers before start have been already replayed, only their
+            current skill and time are used
+        update_difficulty (bool, optional):
+            if False, the difficulty is preserved
+        params:
+            parameters of the model overriding DEFAULT_PARAMS
+    Returns:
+        dict: the state
+    '''
+    model_params = dict(DEFAULT_PARAMS)
+    model_params.update(params)
+    users = np.ascontiguousarray(users, dtype=np.int64)
+    places = np.ascontiguousarray(places, dtype=np.int64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+    options = np.ascontiguousarray(options, dtype=np.int64)
+    run = _elo.replay if _elo is not None else _replay
+    run(
+        users,
+        places,
+        np.ascontiguousarray(correct, dtype=np.uint8),
+        offsets,
+        options,
+        _option_sources(users, places, offsets, options, len(state['difficulty'])),
+        np.ascontiguousarray(inserted, dtype=np.int64),
+        state['prior_skill'],
+        state['user_answers'],
+        state['difficulty'],
+        state['place_answers'],
+        state['current_skill'],
+        start,
+        int(bool(update_difficulty)),
+        model_params['elo_alpha'],
+        model_params['elo_alpha_dynamic'],
+        model_params['pfae_good'],
+        model_params['pfae_bad'],
+        model_params['time_shift'])
+    return state
+
+
+def _options(first):
+    options = first['options'].values if 'options' in first else [None] * len(first)
+    asked = first['place_asked'].values
+    lengths = np.array([len(opts) if opts else 1 for opts in options], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    option_places = np.array(
+        [p for place, opts in zip(asked, options) for p in (opts if opts else [place])],
+        dtype=asked.dtype)
+    return offsets, option_places
+
+
+def _correct(first):
+    return first['place_asked'].values == first['place_answered'].values
+
+
+def _inserted(first):
+    return first['inserted'].values.astype('datetime64[ns]').astype(np.int64)
+
+
+def _option_sources(users, places, offsets, options, n_places):
+    # For each option find the answer in which the user was asked the
+    # option's place: the current skill and the last time of the user for the
+    # place come from this answer (if it has been already processed).
+    keys = users.astype(np.int64) * n_places + places
+    order = np.argsort(keys, kind='mergesort')
+    option_users = np.repeat(users, np.diff(offsets)).astype(np.int64)
+    option_keys = option_users * n_places + options
+    positions = np.searchsorted(keys[order], option_keys)
+    positions[positions == len(keys)] = 0
+    sources = order[positions] if len(keys) > 0 else np.zeros(len(option_keys), dtype=np.int64)
+    found = keys[sources] == option_keys if len(keys) > 0 else np.zeros(len(option_keys), dtype=bool)
+    return np.where(found, sources, -1).astype(np.int64)
+
+
+def _replay(users, places, correct, offsets, options, sources, inserted, prior_skill, user_answers,
+        difficulty, place_answers, current_skill, start, update_difficulty,
+        elo_alpha, elo_alpha_dynamic, pfae_good, pfae_bad, time_shift):
+    users, places, correct = users.tolist(), places.tolist(), correct.tolist()
+    offsets, options, sources, inserted = offsets.tolist(), options.tolist(), sources.tolist(), inserted.tolist()
+    prior = prior_skill.tolist()
+    user_num = user_answers.tolist()
+    place_difficulty = difficulty.tolist()
+    place_num = place_answers.tolist()
+    current = current_skill.tolist()
+    for i in xrange(start, len(users)):
+        user = users[i]
+        user_prior = prior[user]
+        skills = []
+        shifted = []
+        for k in xrange(offsets[i], offsets[i + 1]):
+            source = sources[k]
+            if 0 <= source < i:
+                skill = current[source]
+                seconds = (inserted[i] - inserted[source]) * 1e-9
+            else:
+                skill = user_prior - place_difficulty[options[k]]
+                seconds = NEVER_SECONDS
+            skills.append(skill)
+            shifted.append(skill + time_shift / max(seconds, 0.001))
+        result = correct[i]
+        prior_prediction = predict(skills[0], skills[1:])[0]
+        current_prediction = predict(shifted[0], shifted[1:])[0]
+        first_place = options[offsets[i]]
+        prior[user] = user_prior + elo_alpha / (1 + elo_alpha_dynamic * user_num[user]) * (result - prior_prediction)
+        if update_difficulty:
+            place_difficulty[places[i]] = (
+                place_difficulty[first_place] -
+                elo_alpha / (1 + elo_alpha_dynamic * place_num[first_place]) * (result - prior_prediction))
+        k = pfae_good if result else pfae_bad
+        current[i] = skills[0] + k * (result - current_prediction)
+        user_num[user] += 1
+        place_num[places[i]] += 1
+    prior_skill[:] = prior
+    user_answers[:] = user_num
+    difficulty[:] = place_difficulty
+    place_answers[:] = place_num
+    current_skill[:] = current
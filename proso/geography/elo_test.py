@@ -0,0 +1,74 @@
+import numpy as np
+import pandas
+import proso.geography.difficulty as difficulty
+import proso.geography.elo as elo
+import proso.geography.testing as testing
+import unittest
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.first = _first_answers()
+
+    @unittest.skipIf(elo._elo is None, 'the compiled replay (module _elo) is not built')
+    def test_compiled_same_as_python(self):
+        arrays = elo.answer_arrays(self.first)
+        for update_difficulty in [True, False]:
+            states = []
+            for run in [elo._elo.replay, elo._replay]:
+                state = elo.new_state(len(arrays['user_ids']), len(arrays['place_ids']), len(self.first))
+                state['difficulty'][:] = np.linspace(-1, 1, len(arrays['place_ids']))
+                run(
+                    arrays['users'], arrays['places'], arrays['correct'].astype(np.uint8),
+                    arrays['offsets'], arrays['options'],
+                    elo._option_sources(arrays['users'], arrays['places'], arrays['offsets'], arrays['options'], len(arrays['place_ids'])),
+                    arrays['inserted'], state['prior_skill'], state['user_answers'], state['difficulty'],
+                    state['place_answers'], state['current_skill'], 0, int(update_difficulty),
+                    *[elo.DEFAULT_PARAMS[name] for name in ['elo_alpha', 'elo_alpha_dynamic', 'pfae_good', 'pfae_bad', 'time_shift']])
+                states.append(state)
+            for name in states[0]:
+                self.assertTrue(np.allclose(states[0][name], states[1][name], rtol=1e-12, atol=1e-12), name)
+
+    def test_array_same_as_stream(self):
+        for preserved in [None, {1: 0.5, 2: -0.5}]:
+            stream = difficulty.prepare_difficulty_and_prior_skill(self.first, preserved, engine='stream')
+            array = difficulty.prepare_difficulty_and_prior_skill(self.first, preserved, engine='array')
+            for expected, computed in zip(stream, array):
+                self.assertEqual(sorted(expected.keys()), sorted(computed.keys()))
+                for key, value in expected.iteritems():
+                    self.assertAlmostEqual(value, computed[key], places=10)
+
+    def test_estimate_arrays(self):
+        rows = self.first['user'].values % 3 != 0
+        expected = elo.estimate(self.first[rows])
+        computed = elo.estimate_arrays(elo.answer_arrays(self.first), rows)
+        for expected_values, computed_values in zip(expected, computed):
+            self.assertEqual(sorted(expected_values.keys()), sorted(computed_values.keys()))
+            for key, value in expected_values.iteritems():
+                self.assertAlmostEqual(value, computed_values[key], places=12)
+
+    def test_checkpoint(self):
+        half = len(self.first) / 2
+        older = self.first[:half]
+        # the newer answers must not contain the (user, place) pairs of the older ones
+        pairs = set(zip(older['user'], older['place_asked']))
+        newer = self.first[half:]
+        newer = newer[[pair not in pairs for pair in zip(newer['user'], newer['place_asked'])]]
+        resumed = elo.checkpoint_estimates(elo.checkpoint(newer, elo.checkpoint(older)))
+        full = elo.estimate(pandas.concat([older, newer]))
+        for expected_values, computed_values in zip(full, resumed):
+            self.assertEqual(sorted(expected_values.keys()), sorted(computed_values.keys()))
+            for key, value in expected_values.iteritems():
+                self.assertAlmostEqual(value, computed_values[key], places=12)
+
+
+def _first_answers():
+    answers = testing.random_answers(n=3000, users=60, places=40, days=30, correct=0.6, type=1, response_time=1000)
+    answers = answers.drop_duplicates(['user', 'place_asked']).reset_index(drop=True)
+    rng = np.random.RandomState(1)
+    answers['options'] = [
+        sorted(set([place] + rng.randint(1, 41, rng.randint(1, 4)).tolist())) if rng.rand() < 0.5 else []
+        for place in answers['place_asked'].values
+    ]
+    return answers
@@ -20,9 +20,8 @@ def boxplot_prior_skill(figure, answers, prior_skill, group_column, group_name_m
     ax = figure.add_subplot(111)
     to_plot = []
     group_names = []
-    for group_name, group_data in answers.groupby(group_column):
-        users = group_data['user'].unique()
-        to_plot.append(map(lambda u: prior_skill[u], users))
+    for group_name, group_data in user.summary(answers, group_column, prior_skill).groupby(group_column):
+        to_plot.append(group_data['prior_skill'].values)
         group_names.append(group_name_mapping[group_name] if group_name_mapping else group_name)
     ax.set_ylabel('Prior Skill')
     _boxplot(ax, to_plot, group_names, name='Prior Skill', verbose=verbose)
@@ -37,13 +36,13 @@ def boxplot_feedback_vs_number_of_answers(figure, feedback, answers, verbose=Fal
         apply(lambda x: x['value'].mean()).to_dict())
     labels = []
     to_plot = []
-    answers = answers[answers['user'].isin(first_feedback.keys())]
-    answers['temp_group'] = answers['user'].apply(lambda u: first_feedback[u])
-    for group_name, group_data in answers.groupby('temp_group'):
-        number = user.answers_per_user(group_data)
-        to_plot.append(number.values())
+    summary = user.summary(answers)
+    summary = summary[summary['user'].isin(first_feedback.keys())].copy()
+    summary['temp_group'] = summary['user'].map(lambda u: first_feedback[u])
+    for group_name, group_data in summary.groupby('temp_group'):
+        number = group_data['answers'].values
+        to_plot.append(number)
         labels.append('%s (%s)' % (FEEDBACK_MAPPING[group_name], len(number)))
-    del answers['temp_group']
     ax.set_yscale('log')
     ax.set_ylabel('Number of Answers')
     ax.set_xlabel('First Feedback')
@@ -98,9 +97,12 @@ def plot_feedback_by_group(figure, answers, feedback, group_column, group_name_m
 
 
 def plot_maps_success_vs_number_of_answers(figure, answers, verbose=False):
-    groups = answers.groupby(['place_map_code', 'place_asked_type']).apply(lambda d: (sum(d['place_asked'] == d['place_answered']), len(d))).to_dict()
+    correct = answers['place_asked'] == answers['place_answered']
+    groups = correct.groupby([answers['place_map_code'], answers['place_asked_type']]).agg(['sum', 'count'])
+    # categorical columns produce also the empty groups
+    groups = groups[groups['count'] > 0]
     ax = figure.add_subplot(111)
-    for (map_code, place_type), (correct, number) in groups.iteritems():
+    for (map_code, place_type), (correct, number) in zip(groups.index, groups.values):
         success = float(correct) / number
         ax.plot(number, success, 'o', color='black')
         ax.annotate("%s: %s" % (map_code, place_type), (number, success))
@@ -110,12 +112,9 @@ def plot_maps_success_vs_number_of_answers(figure, answers, verbose=False):
 
 
 def plot_answers_vs_prior_skill(figure, answers, prior_skill, verbose=False):
-    answers = decorator.session_number(answers)
+    summary = user.summary(answers, prior_skill=prior_skill)
     ax = figure.add_subplot(111)
-    total = user.answers_per_user(answers)
-    users = answers['user'].unique()
-    vals = lambda x: [x[i] for i in users]
-    total, prior_skill = zip(*sorted(zip(vals(total), vals(prior_skill))))
+    total, prior_skill = zip(*sorted(zip(summary['answers'].values, summary['prior_skill'].values)))
     ax.plot(total, prior_skill, 'o', alpha=0.3, linewidth=0, color='black')
     ax.set_xlabel('number of answer at all')
     ax.set_ylabel('prior skill')
@@ -123,13 +122,9 @@ def plot_answers_vs_prior_skill(figure, answers, prior_skill, verbose=False):
 
 
 def plot_first_session_vs_total(figure, answers, verbose=False):
-    answers = decorator.session_number(answers)
+    summary = user.summary(answers)
     ax = figure.add_subplot(111)
-    total = user.answers_per_user(answers)
-    total_first = user.answers_per_user(answers[answers['session_number'] == 0])
-    users = answers['user'].unique()
-    vals = lambda x: [x.get(i, 0) for i in users]
-    pairs = map(lambda (x, y): (x, y - x), sorted(zip(vals(total_first), vals(total))))
+    pairs = map(lambda (x, y): (x, y - x), sorted(zip(summary['first_session_answers'].values, summary['answers'].values)))
     total_first, total = zip(*pairs)
     ax.plot(total_first, total, 'o', alpha=0.3, linewidth=0, color='black')
     ax.set_xlabel('number of answers in the first session')
@@ -139,13 +134,9 @@ def plot_first_session_vs_total(figure, answers, verbose=False):
 
 
 def plot_first_session_vs_session_number(figure, answers, verbose=False):
-    answers = decorator.session_number(answers)
+    summary = user.summary(answers)
     ax = figure.add_subplot(111)
-    ses = user.session_per_user(answers)
-    total_first = user.answers_per_user(answers[answers['session_number'] == 0])
-    users = answers['user'].unique()
-    vals = lambda x: [x.get(i, 0) for i in users]
-    total_first, ses = zip(*sorted(zip(vals(total_first), vals(ses))))
+    total_first, ses = zip(*sorted(zip(summary['first_session_answers'].values, summary['sessions'].values - 1)))
     ax.plot(total_first, ses, 'o', alpha=0.3, linewidth=0, color='black')
     ax.set_xlabel('number of answers in the first session')
     ax.set_ylabel('maximal session number')
@@ -157,20 +148,17 @@ def plot_user_ratio(figure, answers, group_column, group_name_mapping=None, answ
     group_names = []
     to_plots = []
     labels = None
-    for group_name, group_data in answers.groupby(group_column):
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
         to_plot = []
         current_labels = []
+        all_users = float(len(group_data))
         if answer_numbers_min is not None:
             for num in answer_numbers_min:
-                filtered_users, all_users = user.user_ratio(group_data, answer_number_min=num)
-                to_plot.append(filtered_users / float(all_users))
+                to_plot.append((group_data['answers'] >= num).sum() / all_users)
                 current_labels.append(str(num) + ' answers')
         else:
             for num in session_numbers:
-                filtered_users, all_users = user.user_ratio(
-                    group_data,
-                    session_number=num)
-                to_plot.append(filtered_users / float(all_users))
+                to_plot.append((group_data['sessions'] > num).sum() / all_users)
                 current_labels.append(str(num + 1) + ' sessions')
         labels = current_labels
         to_plots.append(to_plot)
@@ -213,8 +201,8 @@ def boxplot_maps_per_user(figure, answers, group_column, group_name_mapping=None
     ax = figure.add_subplot(111)
     labels = []
     to_plot = []
-    for group_name, group_data in answers.groupby(group_column):
-        m = user.maps_per_user(group_data).values()
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        m = group_data['maps'].values
         to_plot.append(m)
         labels.append(
             str(group_name_mapping[group_name] if group_name_mapping else group_name) + '\n(' + str(len(m)) + ')')
@@ -225,8 +213,8 @@ def boxplot_success_per_user(figure, answers, group_column, group_name_mapping=N
     ax = figure.add_subplot(111)
     labels = []
     to_plot = []
-    for group_name, group_data in answers.groupby(group_column):
-        s = success.success_per_user(group_data).values()
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        s = group_data['success'].values
         to_plot.append(s)
         labels.append(
             str(group_name_mapping[group_name] if group_name_mapping else group_name) + '\n(' + str(len(s)) + ')')
@@ -237,9 +225,9 @@ def boxplot_answers_per_user(figure, answers, group_column, group_name_mapping=N
     ax = figure.add_subplot(111)
     labels = []
     to_plot = []
-    for group_name, group_data in answers.groupby(group_column):
-        number = user.answers_per_user(group_data)
-        to_plot.append(number.values())
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        number = group_data['answers'].values
+        to_plot.append(number)
         labels.append(
             str(group_name_mapping[group_name] if group_name_mapping else group_name) + '\n(' + str(len(number)) + ')')
     ax.set_yscale('log')
@@ -277,8 +265,8 @@ def hist_maps_per_user(figure, answers, group_column, group_name_mapping=None, v
     ax = figure.add_subplot(111)
     to_plots = []
     group_names = []
-    for group_name, group_data in answers.groupby(group_column):
-        to_plots.append(user.maps_per_user(group_data).values())
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        to_plots.append(group_data['maps'].values)
         group_names.append(group_name)
     if group_name_mapping:
         group_names = [group_name_mapping[group_name] for group_name in group_names]
@@ -300,8 +288,8 @@ def hist_answers_per_user(figure, answers, group_column, group_name_mapping=None
     ax = figure.add_subplot(111)
     to_plots = []
     group_names = []
-    for group_name, group_data in answers.groupby(group_column):
-        to_plots.append(numpy.log10(user.answers_per_user(group_data).values()))
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        to_plots.append(numpy.log10(group_data['answers'].values))
         group_names.append(group_name)
     if group_name_mapping:
         group_names = [group_name_mapping[group_name] for group_name in group_names]
@@ -319,15 +307,16 @@ def hist_answers_per_user(figure, answers, group_column, group_name_mapping=None
     figure.tight_layout()
 
 
-def hist_rolling_success(figure, answers, prior_skill, verbose=False):
+def hist_rolling_success(figure, answers, prior_skill, window_length=10, verbose=False):
+    answers = decorator.rolling_success_column(answers, window_length)[0]
     [answers_low, answers_medium, answers_high] = _split_data_by_skill(
         answers, prior_skill, [25, 75])
     ax = figure.add_subplot(111)
     ax.hist(
         [
-            zip(*success.rolling_success_per_user(answers_low).values())[0],
-            zip(*success.rolling_success_per_user(answers_medium).values())[0],
-            zip(*success.rolling_success_per_user(answers_high).values())[0]
+            zip(*success.rolling_success_per_user(answers_low, window_length).values())[0],
+            zip(*success.rolling_success_per_user(answers_medium, window_length).values())[0],
+            zip(*success.rolling_success_per_user(answers_high, window_length).values())[0]
         ],
         label=['Users with Low Skill', 'Users with Medium Skill', 'Users with High Skill'],
         bins=10,
@@ -389,13 +378,14 @@ def plot_answers_per_week(figure, answers, verbose=False):
         tl.set_color('r')
 
 
-def plot_stay_on_rolling_success(figure, answers, prior_skill, verbose=False):
+def plot_stay_on_rolling_success(figure, answers, prior_skill, window_length=10, verbose=False):
+    answers = decorator.last_in_session(decorator.rolling_success_column(answers, window_length)[0])
     [answers_low, answers_medium, answers_high] = _split_data_by_skill(
         answers, prior_skill, [25, 75])
-    stay_all = sorted(success.stay_on_rolling_success(answers).items())
-    stay_low = sorted(success.stay_on_rolling_success(answers_low).items())
-    stay_medium = sorted(success.stay_on_rolling_success(answers_medium).items())
-    stay_high = sorted(success.stay_on_rolling_success(answers_high).items())
+    stay_all = sorted(success.stay_on_rolling_success(answers, window_length).items())
+    stay_low = sorted(success.stay_on_rolling_success(answers_low, window_length).items())
+    stay_medium = sorted(success.stay_on_rolling_success(answers_medium, window_length).items())
+    stay_high = sorted(success.stay_on_rolling_success(answers_high, window_length).items())
     to_plot = {
         'All Users': stay_all,
         'Users with Low Skill': stay_low,
@@ -409,7 +399,7 @@ def plot_stay_on_rolling_success(figure, answers, prior_skill, verbose=False):
         ax1 = figure.add_subplot(2, 2, i)
         _plot_errorbar(ax1, _to_errorbar)
         ax1.set_title(title)
-        ax1.set_xlabel('rolling success rate (last 10 answers)')
+        ax1.set_xlabel('rolling success rate (last %s answers)' % window_length)
         ax1.set_ylabel('probability of staying')
         ax1.set_ylim(0, 1.0)
         ax2 = ax1.twinx()
@@ -430,11 +420,12 @@ def plot_session_length(figure, answers, portion_min=0.01, verbose=False):
         data = answers
     else:
         data = decorator.session_number(answers)
+    sessions = session.summary(data)
     session_limit = max([session_number if portion >= portion_min else 0
-        for session_number, portion in session.session_user_portion(answers).items()])
-    data = data[data['session_number'] <= session_limit]
+        for session_number, portion in session.user_portion_by_session(sessions).items()])
+    sessions = sessions[sessions['session_number'] <= session_limit]
 
-    length = session.session_length(data).items()
+    length = session.length_by_session(sessions).items()
     ax1 = figure.add_subplot(111)
     ax1.plot(zip(*length)[0], zip(*length)[1], 'b-')
     ax1.set_xlabel('session number')
@@ -442,15 +433,13 @@ def plot_session_length(figure, answers, portion_min=0.01, verbose=False):
     for tl in ax1.get_yticklabels():
         tl.set_color('b')
 
-    users_for_limit = data[data['session_number'] == session_limit]['user'].values
-    data_for_limit = data[data['user'].isin(users_for_limit)]
-    data_for_limit = data_for_limit[data_for_limit['session_number'] <= session_limit]
-    for_limit_length = session.session_length(data_for_limit)
+    users_for_limit = sessions[sessions['session_number'] == session_limit]['user'].values
+    for_limit_length = session.length_by_session(sessions[sessions['user'].isin(users_for_limit)])
     ax1.plot(
         zip(*for_limit_length.items())[0],
         zip(*for_limit_length.items())[1], 'b--')
 
-    hist = session.session_users(data).items()
+    hist = session.users_by_session(sessions).items()
     ax2 = ax1.twinx()
     ax2.set_yscale('log')
     ax2.set_ylabel('number of users', color='r')
@@ -464,12 +453,14 @@ def plot_session_prior_skill(figure, answers, difficulty, portion_min=0.01, verb
         data = answers
     else:
         data = decorator.session_number(answers)
+    sessions = session.summary(data)
     session_limit = max([session_number if portion >= portion_min else 0
-        for session_number, portion in session.session_user_portion(answers).items()])
+        for session_number, portion in session.user_portion_by_session(sessions).items()])
     data = data[data['session_number'] <= session_limit]
+    sessions = sessions[sessions['session_number'] <= session_limit]
 
     prior_skill = session.session_prior_skill(data, difficulty).items()
-    hist = session.session_users(data).items()
+    hist = session.users_by_session(sessions).items()
     ax1 = figure.add_subplot(111)
     ax1.plot(zip(*prior_skill)[0], zip(*prior_skill)[1], 'b-')
     ax1.set_xlabel('session number')
@@ -490,12 +481,13 @@ def plot_session_success(figure, answers, portion_min=0.01, verbose=False):
         data = answers
     else:
         data = decorator.session_number(answers)
+    sessions = session.summary(data)
     session_limit = max([session_number if portion >= portion_min else 0
-        for session_number, portion in session.session_user_portion(answers).items()])
-    data = data[data['session_number'] <= session_limit]
+        for session_number, portion in session.user_portion_by_session(sessions).items()])
+    sessions = sessions[sessions['session_number'] <= session_limit]
 
-    success = session.session_success(data).items()
-    hist = session.session_users(data).items()
+    success = session.success_by_session(sessions).items()
+    hist = session.users_by_session(sessions).items()
     ax1 = figure.add_subplot(111)
     ax1.plot(zip(*success)[0], zip(*success)[1], 'b-')
     ax1.set_xlabel('session number')
@@ -0,0 +1,285 @@
+"""
+Dense integer codes of the users the answers refer to. The codes are
+assigned once when the answers are loaded, so the aggregations over users
+can use numpy.bincount and array indexing instead of hashing the ids in each
+groupby. The columns containing string codes (maps, place types) are stored
+as categorical. The per-user metrics run over the user index (see
+user_index) which groups the rows by user once for each data frame.
+"""
+
+from collections import OrderedDict
+import cache
+import numpy as np
+import pandas
+
+
+CATEGORICAL_COLUMNS = ['place_map_code', 'place_asked_type', 'place_map_type']
+
+# number of the most recently used values kept by frame_cached
+FRAME_CACHE_SIZE = 16
+
+_FRAME_CACHE = OrderedDict()
+
+
+def encode(answers, users=None):
+    '''
+    Assign dense int32 codes to the users (column 'user_code') and convert
+    the string columns (CATEGORICAL_COLUMNS) to categorical.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        users (numpy.ndarray, optional):
+            sorted array of the user ids the codes refer to, by default the
+            users of the given answers (see user_table)
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    if users is None:
+        users = user_table(answers)
+    answers['user_code'] = codes(answers['user'].values, users)
+    return encode_categories(answers)
+
+
+def user_table(answers):
+    '''
+    Sorted array of the user ids the codes refer to. The table depends only
+    on the given answers, so it is the same each time it is computed from
+    the same data.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+    Returns:
+        numpy.ndarray: sorted array of user ids
+    '''
+    return _table(answers['user'].values)
+
+
+def encode_categories(answers):
+    '''
+    Convert the string columns (CATEGORICAL_COLUMNS) to categorical. The
+    columns already converted are left as they are.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    for column in CATEGORICAL_COLUMNS:
+        if column in answers and not isinstance(answers[column].values, pandas.Categorical):
+            answers[column] = pandas.Categorical(answers[column].values)
+    return answers
+
+
+def codes(values, table):
+    '''
+    Translate the given ids to their codes.
+
+    Args:
+        values (numpy.ndarray):
+            ids
+        table (numpy.ndarray):
+            sorted array of ids
+    Returns:
+        numpy.ndarray: int32 codes, -1 for the ids missing in the table
+    '''
+    positions = np.searchsorted(table, values)
+    positions[positions == len(table)] = 0
+    found = table[positions] == values if len(table) > 0 else np.zeros(len(values), dtype=bool)
+    return np.where(found, positions, -1).astype(np.int32)
+
+
+def user_codes(answers):
+    '''
+    Dense codes of the users having answers in the given data frame. The ids
+    are recovered from the data frame itself, so no lookup table is needed.
+    If the codes do not match the users (e.g. the user column was changed
+    after the codes were assigned), the codes are assigned again.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data decorated by 'user_code'
+    Returns:
+        (numpy.ndarray, numpy.ndarray): code of each answer's user, user's id
+        for each code (defined only for the codes present in the answers)
+    '''
+    codes = answers['user_code'].values
+    values = answers['user'].values
+    users = np.zeros(codes.max() + 1 if len(codes) > 0 else 0, dtype=values.dtype)
+    users[codes] = values
+    known = codes >= 0
+    if not (users[codes[known]] == values[known]).all():
+        users, codes = np.unique(values, return_inverse=True)
+    return codes, users
+
+
+class UserIndex:
+
+    """
+    Rows of the answers grouped by user: the rows of the i-th user are
+    order[offsets[i]:offsets[i + 1]] (in the order of the data frame). The
+    reductions run over these segments, so they need neither hashing nor
+    a groupby. If the index is grouped by a column too, the segments are
+    (group, user) pairs and the group of each segment is in groups.
+    """
+
+    def __init__(self, codes, users, groups=None):
+        self.order = np.argsort(codes, kind='mergesort')
+        counts = np.bincount(codes, minlength=max(len(users), 1))[:len(users)]
+        present = counts > 0
+        self.users = users[present]
+        self.groups = groups[present] if groups is not None else None
+        self.counts = counts[present]
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.segments = np.repeat(np.arange(len(self.users)), self.counts)
+
+    def __len__(self):
+        return len(self.users)
+
+    def reduce(self, ufunc, values):
+        '''
+        Reduce the values of each user by the given ufunc (e.g. np.add,
+        np.maximum).
+
+        Args:
+            ufunc (numpy.ufunc):
+                binary ufunc
+            values (numpy.ndarray):
+                values aligned with the rows of the data frame
+        Returns:
+            numpy.ndarray: reduced value for each user
+        '''
+        if len(self.users) == 0:
+            return np.array([], dtype=np.asarray(values).dtype)
+        return ufunc.reduceat(np.asarray(values)[self.order], self.offsets[:-1])
+
+    def sum(self, values):
+        return self.reduce(np.add, values)
+
+    def max(self, values):
+        return self.reduce(np.maximum, values)
+
+    def mean(self, values):
+        return self.sum(np.asarray(values, dtype=np.float64)) / self.counts
+
+    def std(self, values):
+        '''
+        Sample standard deviation of the values of each user (NaN for the
+        users with only one value).
+        '''
+        values = np.asarray(values, dtype=np.float64)[self.order]
+        deviations = values - (np.add.reduceat(values, self.offsets[:-1]) / self.counts)[self.segments]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(np.add.reduceat(deviations ** 2, self.offsets[:-1]) / (self.counts - 1))
+
+    def nunique(self, values):
+        '''
+        Number of distinct values of each user, missing values are
+        counted as distinct values.
+        '''
+        values = np.asarray(values)[self.order]
+        if values.dtype.kind == 'f':
+            values = values.astype(np.float64)
+            values[np.isnan(values)] = -np.inf
+        order = np.lexsort((values, self.segments))
+        values = values[order]
+        new = np.ones(len(values), dtype=np.int64)
+        new[1:] = (values[1:] != values[:-1]) | (self.segments[1:] != self.segments[:-1])
+        return np.add.reduceat(new, self.offsets[:-1]) if len(new) > 0 else new
+
+    def to_dict(self, values):
+        return dict(zip(self.users, values))
+
+
+def user_index(answers, group_column=None):
+    '''
+    Get the index of rows grouped by user (and the given column) for the given
+    data frame. The index is built only once for the data frame (see
+    frame_cached).
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        group_column (str, optional):
+            if given, the rows are grouped by this column and user
+    Returns:
+        proso.geography.ids.UserIndex
+    '''
+    return frame_cached(
+        answers, ('user_index', group_column), lambda: _user_index(answers, group_column),
+        columns=['user', 'user_code'] + ([group_column] if group_column is not None else []))
+
+
+def frame_cached(answers, name, compute, columns=None):
+    '''
+    Compute the value derived from the given columns of the data frame only
+    once. The value is kept under the content hash of the columns (see
+    proso.geography.cache.array_hash), so it is recomputed whenever their
+    values change and it is shared by the data frames having the same values
+    in the columns. Only FRAME_CACHE_SIZE most recently used values are kept.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+        name (object):
+            hashable name of the value
+        compute (function):
+            function without arguments computing the value
+        columns (list, optional):
+            all the columns the value is computed from, by default ['user']
+    Returns:
+        object: the value
+    '''
+    if columns is None:
+        columns = ['user']
+    key = (name, len(answers)) + tuple(_column_hash(answers, column) for column in columns)
+    value = _FRAME_CACHE.pop(key) if key in _FRAME_CACHE else compute()
+    _FRAME_CACHE[key] = value
+    while len(_FRAME_CACHE) > FRAME_CACHE_SIZE:
+        _FRAME_CACHE.popitem(last=False)
+    return value
+
+
+def _user_index(answers, group_column):
+    if 'user_code' in answers:
+        codes, users = user_codes(answers)
+    else:
+        users, codes = np.unique(answers['user'].values, return_inverse=True)
+    if group_column is None:
+        return UserIndex(codes, users)
+    group_values = np.asarray(answers[group_column].values)
+    group_codes = np.unique(group_values, return_inverse=True)[1]
+    pair_codes = np.unique(group_codes * np.int64(len(users)) + codes, return_inverse=True)[1]
+    pair_users = np.zeros(pair_codes.max() + 1 if len(pair_codes) > 0 else 0, dtype=users.dtype)
+    pair_users[pair_codes] = users[codes]
+    pair_groups = np.empty(len(pair_users), dtype=group_values.dtype)
+    pair_groups[pair_codes] = group_values
+    return UserIndex(pair_codes, pair_users, pair_groups)
+
+
+def _column_hash(answers, column):
+    if column not in answers:
+        return None
+    values = answers[column].values
+    if isinstance(values, pandas.Categorical):
+        return cache.array_hash(values.codes), cache.array_hash(_hashable(values.categories.values))
+    return cache.array_hash(_hashable(values))
+
+
+def _hashable(values):
+    # the content hash needs the values themselves in the array's buffer
+    if values.dtype.kind == 'O':
+        return values.astype(unicode)
+    if values.dtype.kind in 'mM':
+        return values.view(np.int64)
+    return values
+
+
+def _table(values):
+    if values.dtype.kind == 'f':
+        values = values[np.isfinite(values)]
+        if (values == np.round(values)).all():
+            values = values.astype(np.int64)
+    return np.unique(values)
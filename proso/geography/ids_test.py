@@ -0,0 +1,129 @@
+import numpy as np
+import pandas
+import proso.geography.decorator as decorator
+import proso.geography.ids as ids
+import proso.geography.session as session
+import proso.geography.testing as testing
+import proso.geography.user as user
+import unittest
+
+
+class CodesTest(unittest.TestCase):
+
+    def test_codes(self):
+        table = np.array([3, 7, 10])
+        self.assertEqual(ids.codes(np.array([10, 3, 4, 7, 11, 0]), table).tolist(), [2, 0, -1, 1, -1, -1])
+        self.assertEqual(ids.codes(np.array([1, 2]), np.array([], dtype=np.int64)).tolist(), [-1, -1])
+
+    def test_encode(self):
+        answers = _answers()
+        answers['user'] = answers['user'].astype(float)
+        answers.loc[answers.index[:10], 'user'] = np.nan
+        encoded = ids.encode(answers.copy())
+        known = encoded['user'].notnull().values
+        self.assertTrue((encoded['user_code'].values[~known] == -1).all())
+        users = ids.user_table(answers)
+        self.assertEqual(users.dtype.kind, 'i')
+        self.assertTrue((users[encoded['user_code'].values[known]] == encoded['user'].values[known]).all())
+
+    def test_user_codes(self):
+        answers = ids.encode(_answers())
+        codes, users = ids.user_codes(answers[answers['user'] > 7])
+        filtered = answers[answers['user'] > 7]
+        self.assertTrue((users[codes] == filtered['user'].values).all())
+
+
+class UserIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.answers = ids.encode(_answers())
+        self.answers['value'] = np.random.RandomState(1).randn(len(self.answers))
+        self.answers.loc[self.answers.index[::13], 'place_answered'] = np.nan
+        self.grouped = self.answers.groupby('user')
+
+    def test_reductions(self):
+        index = ids.user_index(self.answers)
+        self.assertEqual(index.users.tolist(), sorted(self.grouped.groups.keys()))
+        self.assertEqual(index.counts.tolist(), self.grouped.size().tolist())
+        values = self.answers['value'].values
+        self.assertTrue(np.allclose(index.sum(values), self.grouped['value'].sum().values))
+        self.assertTrue(np.allclose(index.max(values), self.grouped['value'].max().values))
+        self.assertTrue(np.allclose(index.mean(values), self.grouped['value'].mean().values))
+        self.assertTrue(np.allclose(index.std(values), self.grouped['value'].std().values))
+        self.assertEqual(
+            index.nunique(self.answers['place_answered'].values).tolist(),
+            self.grouped['place_answered'].apply(lambda values: len(set(values.fillna(-1)))).tolist())
+        self.assertEqual(index.to_dict(index.counts), self.grouped.size().to_dict())
+
+    def test_single_answer_std(self):
+        index = ids.UserIndex(np.array([0, 1, 1]), np.array([5, 6]))
+        std = index.std(np.array([1.0, 2.0, 4.0]))
+        self.assertTrue(np.isnan(std[0]))
+        self.assertAlmostEqual(std[1], np.std([2.0, 4.0], ddof=1))
+
+    def test_grouped(self):
+        index = ids.user_index(self.answers, 'place_map')
+        grouped = self.answers.groupby(['place_map', 'user'])
+        expected = grouped['value'].sum()
+        computed = pandas.Series(index.sum(self.answers['value'].values), index=pandas.MultiIndex.from_arrays([index.groups, index.users]))
+        self.assertEqual(sorted(computed.index.tolist()), sorted(expected.index.tolist()))
+        self.assertTrue(np.allclose(computed.sort_index().values, expected.sort_index().values))
+
+    def test_empty(self):
+        index = ids.user_index(self.answers[self.answers['user'] < 0])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(len(index.sum(np.array([], dtype=np.int64))), 0)
+
+
+class FrameCachedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.answers = ids.encode(decorator.decorate(_answers()))
+
+    def test_value_kept(self):
+        first = ids.user_index(self.answers)
+        self.assertTrue(ids.user_index(self.answers) is first)
+        self.assertTrue(ids.user_index(self.answers, 'place_map') is not first)
+
+    def test_column_reassigned(self):
+        before = session.summary(self.answers)
+        self.answers['session_number'] = np.zeros(len(self.answers), dtype=self.answers['session_number'].dtype)
+        after = session.summary(self.answers)
+        self.assertTrue(len(before) > len(after))
+        self.assertEqual(list(after['session_number'].unique()), [0])
+        self.assertTrue((user.summary(self.answers)['sessions'] == 1).all())
+
+    def test_group_column_reassigned(self):
+        self.answers['group'] = self.answers['user'].values % 2
+        self.assertEqual(set(ids.user_index(self.answers, 'group').groups), set([0, 1]))
+        self.answers['group'] = np.zeros(len(self.answers), dtype=self.answers['group'].dtype)
+        self.assertEqual(set(ids.user_index(self.answers, 'group').groups), set([0]))
+
+    def test_filtered(self):
+        first = ids.user_index(self.answers)
+        filtered = self.answers[self.answers['user'] > 7]
+        self.assertTrue(ids.user_index(self.answers) is first)
+        self.assertEqual(list(ids.user_index(filtered).users), sorted(filtered['user'].unique()))
+
+    def test_other_column_set(self):
+        first = ids.user_index(self.answers)
+        summary = user.summary(self.answers)
+        self.answers['extra'] = 1
+        self.assertTrue(ids.user_index(self.answers) is first)
+        self.assertTrue(user.summary(self.answers) is summary)
+
+    def test_values_written(self):
+        ids.user_index(self.answers, 'place_map')
+        self.answers['place_map'].values[:] = 1
+        self.assertEqual(set(ids.user_index(self.answers, 'place_map').groups), set([1]))
+
+    def test_user_changed(self):
+        ids.user_index(self.answers)
+        self.answers.loc[self.answers.index[:5], 'user'] = 100
+        index = ids.user_index(self.answers)
+        self.assertEqual(index.users.tolist(), sorted(self.answers['user'].unique()))
+        self.assertEqual(index.to_dict(index.counts)[100], 5)
+
+
+def _answers():
+    return testing.random_answers(users=15, place_map=lambda rng, answers: rng.randint(1, 4, len(answers)))
@@ -1,3 +1,7 @@
+import ids
+import numpy as np
+
+
 def success_per_week(answers):
     return (answers.
         set_index('inserted').
@@ -19,17 +23,36 @@ def success_by_user_per_week(answers):
 
 
 def time_gap(answers):
+    '''
+    Average time gap between the consecutive answers (in the order of the
+    data frame) to the same place for each user and place asked more than
+    once.
 
-    def _time_gap(data):
-        items = map(
-            lambda (p, n): p,
-            filter(lambda (p, n): n > 1, data.groupby('place_asked').apply(len).to_dict().items()))
-        data = data[data['place_asked'].isin(items)]
-        result = data.groupby('place_asked').apply(
-            lambda d: (d['inserted'] - d['inserted'].shift(1)).mean().item() / 10.0 ** 9)
-        return result.to_dict().values()
-    result = answers.groupby('user').apply(_time_gap)
-    return result.to_dict()
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data
+
+    Return:
+        dict: user -> list of time gaps (seconds)
+    '''
+    index = ids.user_index(answers)
+    places = answers['place_asked'].values[index.order]
+    inserted = answers['inserted'].values[index.order].astype(np.int64)
+    # stable, so the rows of each place keep the order of the data frame
+    order = np.lexsort((places, index.segments))
+    places, inserted, segments = places[order], inserted[order], index.segments[order]
+    starts = np.ones(len(places), dtype=bool)
+    starts[1:] = (places[1:] != places[:-1]) | (segments[1:] != segments[:-1])
+    firsts = np.flatnonzero(starts)
+    lasts = np.append(firsts[1:], len(places)) - 1
+    repeated = lasts > firsts
+    firsts, lasts = firsts[repeated], lasts[repeated]
+    # the mean of the consecutive differences is (last - first) / (n - 1)
+    gaps = np.trunc((inserted[lasts] - inserted[firsts]) / (lasts - firsts).astype(np.float64)) / 10.0 ** 9
+    result = dict((u, []) for u in index.users)
+    for segment, gap in zip(segments[firsts], gaps):
+        result[index.users[segment]].append(gap)
+    return result
 
 
 def users_per_week(answers):
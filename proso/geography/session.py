@@ -1,10 +1,91 @@
 import decorator
+import ids
 import user
 import numpy as np
+import pandas
 import proso.geography.answers
 import difficulty
 
 
+# columns of the answers the session summary is computed from (the ids order
+# the answers if they are not decorated by the session number)
+SUMMARY_COLUMNS = ['id', 'user', 'session_number', 'inserted', 'place_asked', 'place_answered']
+
+
+def summary(answers):
+    '''
+    Summary of the sessions computed in one pass: for each user and session
+    number the number of answers ('length'), the number of correct answers
+    ('correct'), the time of the first and the last answer ('start', 'end')
+    and whether it is the user's last session ('last'). The summary is
+    computed only once for the data frame.
+
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data, if it is not decorated by 'session_number',
+            it will be decorated
+    Return:
+        pandas.DataFrame: one row for each user and session number
+    '''
+    return ids.frame_cached(answers, 'session_summary', lambda: _summary(answers), columns=SUMMARY_COLUMNS)
+
+
+def user_portion_by_session(sessions):
+    '''
+    For each session number compute how many users have answer with it.
+
+    Args:
+        sessions (pandas.DataFrame):
+            session summary (see summary)
+    Return:
+        dict: session number -> number from (0,1)
+    '''
+    all_users = float(sessions['user'].nunique())
+    return (sessions.groupby('session_number').size() / all_users).to_dict()
+
+
+def length_by_session(sessions):
+    '''
+    Compute average length of session according to the session number.
+
+    Args:
+        sessions (pandas.DataFrame):
+            session summary (see summary)
+    Return:
+        dict: session number -> number of answers
+    '''
+    return sessions.groupby('session_number')['length'].mean().to_dict()
+
+
+def success_by_session(sessions):
+    '''
+    Compute success rate for each session number (the mean of the users'
+    success rates).
+
+    Args:
+        sessions (pandas.DataFrame):
+            session summary (see summary)
+    Return:
+        dict: session number -> success rate
+    '''
+    success = sessions['correct'] / sessions['length'].astype(float)
+    return success.groupby(sessions['session_number']).mean().to_dict()
+
+
+def users_by_session(sessions):
+    '''
+    Compute number of users having answers in the given sessions according to
+    the session number.
+
+    Args:
+        sessions (pandas.DataFrame):
+            session summary (see summary)
+    Return:
+        dict: session number -> number of users
+    '''
+    return sessions.groupby('session_number').size().to_dict()
+
+
 def session_user_portion(answers):
     '''
     For each session number compute how many users have answer with it.
@@ -16,15 +97,7 @@ def session_user_portion(answers):
     Return:
         dict: session number -> number from (0,1)
     '''
-    if 'session_number' in answers:
-        data = answers
-    else:
-        data = decorator.session_number(answers)
-    all_users = float(data['user'].nunique())
-    return (data.
-        groupby('session_number').
-        apply(lambda x: x['user'].nunique() / all_users).
-        to_dict())
+    return user_portion_by_session(summary(answers))
 
 
 def session_length(answers):
@@ -38,21 +111,7 @@ def session_length(answers):
     Return:
         dict: session number -> number of answers
     '''
-    if 'session_number' in answers:
-        data = answers
-    else:
-        data = decorator.session_number(answers)
-    return (data.
-        groupby(['user', 'session_number']).
-        apply(lambda x: len(x)).
-        reset_index().
-        rename(columns={0: 'session_length'}).
-        groupby('session_number').
-        apply(lambda x: x['session_length'].mean()).
-        reset_index().
-        rename(columns={0: 'session_length'}).
-        set_index('session_number')['session_length'].
-        to_dict())
+    return length_by_session(summary(answers))
 
 
 def session_prior_skill_diffs(answers, difficulty_data, session_number_first, session_number_second):
@@ -124,10 +183,16 @@ def session_prior_skill(answers, difficulty_data):
         data = answers
     else:
         data = decorator.session_number(answers)
-    return (data.
-        groupby('session_number').
-        apply(lambda x: np.mean(difficulty.prepare_difficulty_and_prior_skill(x, difficulty_data)[1].values())).
-        to_dict())
+    if not difficulty_data:
+        return (data.
+            groupby('session_number').
+            apply(lambda x: np.mean(difficulty.prepare_difficulty_and_prior_skill(x, difficulty_data)[1].values())).
+            to_dict())
+    prior_skill = difficulty.prepare_prior_skill_by_group(data, difficulty_data, 'session_number')
+    return dict([
+        (session_number, np.mean(skills.values()))
+        for session_number, skills in prior_skill.iteritems()
+    ])
 
 
 def session_success(answers):
@@ -141,18 +206,7 @@ def session_success(answers):
     Return:
         dict: session number -> success rate
     '''
-    if 'session_number' in answers:
-        data = answers
-    else:
-        data = decorator.session_number(answers)
-    return (data.
-        groupby(['user', 'session_number']).
-        apply(lambda x: float(len(x[x['place_asked'] == x['place_answered']])) / float(len(x))).
-        reset_index().
-        rename(columns={0: 'success'}).
-        groupby('session_number').
-        apply(lambda x: x['success'].mean()).
-        to_dict())
+    return success_by_session(summary(answers))
 
 
 def session_users(answers):
@@ -167,17 +221,32 @@ def session_users(answers):
     Return:
         dict: session number -> number of users
     '''
-    if 'session_number' in answers:
-        data = answers
-    else:
-        data = decorator.session_number(answers)
-    return (data.
-        groupby(['session_number']).
-        apply(lambda x: x['user'].nunique()).
-        reset_index().
-        rename(columns={0: 'frequency'}).
-        set_index('session_number')['frequency'].
-        to_dict())
+    return users_by_session(summary(answers))
+
+
+def _summary(answers):
+    if 'session_number' not in answers:
+        answers = decorator.session_number(answers)
+    users = answers['user'].values
+    session_numbers = answers['session_number'].values
+    order = np.lexsort((session_numbers, users))
+    users, session_numbers = users[order], session_numbers[order]
+    starts = np.ones(len(users), dtype=bool)
+    starts[1:] = (users[1:] != users[:-1]) | (session_numbers[1:] != session_numbers[:-1])
+    offsets = np.flatnonzero(starts)
+    result = pandas.DataFrame({'user': users[offsets], 'session_number': session_numbers[offsets]})
+    if len(offsets) == 0:
+        for column in ['length', 'correct', 'start', 'end', 'last']:
+            result[column] = []
+        return result
+    correct = (answers['place_asked'].values == answers['place_answered'].values)[order]
+    inserted = answers['inserted'].values.astype(np.int64)[order]
+    result['length'] = np.diff(np.append(offsets, len(users)))
+    result['correct'] = np.add.reduceat(correct.astype(np.int64), offsets)
+    result['start'] = np.minimum.reduceat(inserted, offsets).astype('datetime64[ns]')
+    result['end'] = np.maximum.reduceat(inserted, offsets).astype('datetime64[ns]')
+    result['last'] = np.append(users[offsets][1:] != users[offsets][:-1], True)
+    return result[['user', 'session_number', 'length', 'correct', 'start', 'end', 'last']]
 
 
 def _session_success_diff_for_user(answers, session_number_first, session_number_second):
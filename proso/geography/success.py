@@ -1,12 +1,11 @@
 import decorator
+import ids
 import numpy as np
 
 
 def success_per_user(answers):
-    return (answers.
-        groupby('user').
-        apply(lambda x: sum(x['place_asked'] == x['place_answered']) / float(len(x))).
-        to_dict())
+    index = ids.user_index(answers)
+    return index.to_dict(index.mean(answers['place_asked'].values == answers['place_answered'].values))
 
 
 def rolling_success_per_user(answers, window_length=10):
@@ -22,15 +21,11 @@ def rolling_success_per_user(answers, window_length=10):
     Return:
         dict: user -> (rolling success mean, standard deviation)
     '''
-    if 'rolling_success' in answers:
-        data = answers
-    else:
-        data = decorator.rolling_success(answers, window_length=window_length)
-    data = data[~data['rolling_success'].isnull()]
-    return (data.
-        groupby('user').
-        apply(lambda x: (x['rolling_success'].dropna().mean(), x['rolling_success'].dropna().std())).
-        to_dict())
+    data, column = decorator.rolling_success_column(answers, window_length)
+    data = data[~data[column].isnull()]
+    index = ids.user_index(data)
+    values = data[column].values
+    return index.to_dict(zip(index.mean(values), index.std(values)))
 
 
 def stay_on_rolling_success(answers, window_length=10):
@@ -47,16 +42,15 @@ def stay_on_rolling_success(answers, window_length=10):
     Return:
         dict: success rate -> (probability the user stays in the system, standard deviation, number of samples)
     '''
-    if 'rolling_success' in answers:
-        data = answers
-    else:
-        data = decorator.rolling_success(answers, window_length=window_length)
-    data = data[np.isfinite(data['rolling_success'])]
+    data, column = decorator.rolling_success_column(answers, window_length)
+    if 'last_in_session' not in data:
+        data = decorator.last_in_session(data)
+    data = data[np.isfinite(data[column])]
     return (data.
-        groupby(['user', 'rolling_success']).
+        groupby(['user', column]).
         apply(lambda x: sum(~x['last_in_session']) / float(len(x))).
         reset_index().
         rename(columns={0: 'stay'}).
-        groupby('rolling_success').
+        groupby(column).
         apply(lambda x: (x['stay'].mean(), x['stay'].std(), len(x))).
         to_dict())
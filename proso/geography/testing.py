@@ -0,0 +1,49 @@
+"""
+Synthetic answer data for the unit tests (the *_test.py modules).
+"""
+
+import numpy as np
+import pandas
+
+
+def random_answers(n=1000, users=20, seed=0, places=30, days=5, correct=0.7, **extra_columns):
+    '''
+    Generate random answers: each user answers in short bursts during the
+    given number of days (starting on 2014-10-01), so the users have several
+    sessions. The answers are sorted by time and their ids follow this order.
+
+    Args:
+        n (int, optional):
+            number of answers
+        users (int, optional):
+            number of users (their ids are 1 to users)
+        seed (int, optional):
+            seed of the random generator
+        places (int, optional):
+            number of places (their ids are 1 to places)
+        days (int, optional):
+            number of days the answers are spread over
+        correct (float, optional):
+            probability of the correct answer (the wrong answers pick a random
+            place)
+        extra_columns:
+            additional columns, either the values or a function
+            (numpy.random.RandomState, pandas.DataFrame) -> values, the
+            functions are called in the order of the column names
+    Returns:
+        pandas.DataFrame: data frame containing answer data
+    '''
+    rng = np.random.RandomState(seed)
+    seconds = rng.randint(0, days, n) * 86400 + rng.randint(0, 4, n) * 3600 + rng.randint(0, 1200, n)
+    place_asked = rng.randint(1, places + 1, n)
+    answers = pandas.DataFrame({
+        'id': np.arange(1, n + 1),
+        'user': rng.randint(1, users + 1, n),
+        'inserted': pandas.Timestamp('2014-10-01') + pandas.to_timedelta(np.sort(seconds), unit='s'),
+        'place_asked': place_asked,
+        'place_answered': np.where(rng.rand(n) < correct, place_asked, rng.randint(1, places + 1, n)).astype(float),
+    })
+    for name in sorted(extra_columns):
+        values = extra_columns[name]
+        answers[name] = values(rng, answers) if callable(values) else values
+    return answers
@@ -1,6 +1,5 @@
 from prettytable import PrettyTable
 import proso.geography.user as user
-import proso.geography.success as success
 import numpy
 import scipy.stats
 import sys
@@ -12,8 +11,8 @@ def answers_per_user(output, answers, group_column, group_name_mapping=None):
     table = PrettyTable([
         'Group', 'Size', 'Mean', "Std.", "Log Mean", 'Median', '25 Perc.', '75 Perc.', 'Mean Success'])
     table.align['Group'] = 'l'
-    for group_name, group_data in answers.groupby(group_column):
-        numbers = user.answers_per_user(group_data).values()
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        numbers = group_data['answers'].values
         table.add_row([
             group_name if group_name_mapping is None else group_name_mapping[group_name],
             len(numbers),
@@ -23,7 +22,7 @@ def answers_per_user(output, answers, group_column, group_name_mapping=None):
             numpy.median(numbers),
             numpy.round(numpy.percentile(numbers, 25), 2),
             numpy.round(numpy.percentile(numbers, 75), 2),
-            numpy.round(numpy.mean(success.success_per_user(group_data).values()), 2)])
+            numpy.round(numpy.mean(group_data['success'].values), 2)])
     output.write(table.get_string(sortby="Group"))
     output.write("\n")
 
@@ -31,9 +30,9 @@ def answers_per_user(output, answers, group_column, group_name_mapping=None):
 def answers_per_user_pvalues(output, answers, group_column, group_name_mapping=None):
     _header(output, "Answers per User - P Values (log): %s" % group_column)
     numbers = {}
-    for group_name, group_data in answers.groupby(group_column):
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
         g_name = group_name if group_name_mapping is None else group_name_mapping[group_name]
-        numbers[g_name] = numpy.log(user.answers_per_user(group_data).values())
+        numbers[g_name] = numpy.log(group_data['answers'].values)
     table = PrettyTable(["Group"] + sorted(numbers.keys()))
     table.align['Group'] = 'l'
     numbers = sorted(numbers.items())
@@ -52,17 +51,14 @@ def user_ratio(output, answers, group_column, group_name_mapping=None):
 
     table = PrettyTable(['Group', '20 answers', "50 answers", "100 answers", '2 sessions'])
     table.align['Group'] = 'l'
-    for group_name, group_data in answers.groupby(group_column):
-        cell_ans_num_20 = user.user_ratio(group_data, answer_number_min=20)
-        cell_ans_num_50 = user.user_ratio(group_data, answer_number_min=50)
-        cell_ans_num_100 = user.user_ratio(group_data, answer_number_min=100)
-        cell_sess_num_2 = user.user_ratio(group_data, session_number=2)
+    for group_name, group_data in user.summary(answers, group_column).groupby(group_column):
+        all_users = float(len(group_data))
         table.add_row([
             group_name if group_name_mapping is None else group_name_mapping[group_name],
-            numpy.round(cell_ans_num_20[0] / float(cell_ans_num_20[1]), 2),
-            numpy.round(cell_ans_num_50[0] / float(cell_ans_num_50[1]), 2),
-            numpy.round(cell_ans_num_100[0] / float(cell_ans_num_100[1]), 2),
-            numpy.round(cell_sess_num_2[0] / float(cell_sess_num_2[1]), 2)])
+            numpy.round((group_data['answers'] >= 20).sum() / all_users, 2),
+            numpy.round((group_data['answers'] >= 50).sum() / all_users, 2),
+            numpy.round((group_data['answers'] >= 100).sum() / all_users, 2),
+            numpy.round((group_data['sessions'] > 2).sum() / all_users, 2)])
     output.write(table.get_string(sortby="Group"))
     output.write("\n")
 
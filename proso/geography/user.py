@@ -1,14 +1,23 @@
 import decorator
+import ids
+import numpy as np
 import pandas
 
 
+# columns of the answers the user summary is computed from (the ids order the
+# answers if they are not decorated by the session number)
+SUMMARY_COLUMNS = ['id', 'user', 'user_code', 'session_number', 'inserted', 'place_map', 'place_asked', 'place_answered']
+
+
 def session_per_user(answers):
     answers = decorator.session_number(answers)
-    return answers.groupby('user').apply(lambda x: x['session_number'].max()).to_dict()
+    index = ids.user_index(answers)
+    return index.to_dict(index.max(answers['session_number'].values))
 
 
 def maps_per_user(answers):
-    return answers.groupby('user').apply(lambda x: len(x['place_map'].unique())).to_dict()
+    index = ids.user_index(answers)
+    return index.to_dict(index.nunique(answers['place_map'].values))
 
 
 def answers_pers_place_user(answers):
@@ -19,16 +28,46 @@ def answers_pers_place_user(answers):
 
 def user_ratio(answers, session_number=None, answer_number_min=None, answer_number_max=None):
     answers = decorator.session_number(answers)
+    index = ids.user_index(answers)
+    valid = np.ones(len(index), dtype=bool)
+    if session_number is not None:
+        valid &= index.max(answers['session_number'].values) >= session_number
+    if answer_number_min is not None:
+        valid &= index.counts >= answer_number_min
+    elif answer_number_max is not None:
+        valid &= index.counts <= answer_number_max
+    return valid.sum(), len(index)
+
+
+def summary(answers, group_column=None, prior_skill=None):
+    '''
+    Summary of the users computed in one pass: number of answers ('answers'),
+    number of sessions ('sessions'), number of maps ('maps', if the answers
+    contain 'place_map'), success rate ('success'), time of the first and the
+    last answer ('first_inserted', 'last_inserted') and number of answers in
+    the first session ('first_session_answers'). The summary is computed only
+    once for the data frame.
 
-    def user_ratio_filter(data):
-        if session_number is not None and session_number > data['session_number'].max():
-            return False
-        if answer_number_min is not None:
-            return answer_number_min <= len(data)
-        if answer_number_max is not None:
-            return answer_number_max >= len(data)
-        return True
-    return sum(answers.groupby('user').apply(user_ratio_filter)), answers['user'].nunique()
+    Args:
+        answers (pandas.DataFrame):
+            data frame containing answer data, if it is not decorated by
+            'session_number', it will be decorated
+        group_column (str, optional):
+            if given, the users are summarized separately for each value of
+            the column (the summary contains this column too)
+        prior_skill (dict, optional):
+            user -> prior skill, if given the summary contains 'prior_skill'
+            column
+    Return:
+        pandas.DataFrame: one row for each user (and group)
+    '''
+    result = ids.frame_cached(
+        answers, ('summary', group_column), lambda: _summary(answers, group_column),
+        columns=SUMMARY_COLUMNS + ([group_column] if group_column is not None else []))
+    if prior_skill is not None:
+        result = result.copy()
+        result['prior_skill'] = result['user'].map(lambda u: prior_skill[u])
+    return result
 
 
 def prior_skill_to_dataframe(prior_skill):
@@ -51,7 +90,25 @@ def answers_per_user(answers):
     Return:
         dict: user's id -> number of answers
     '''
-    return (answers.
-        groupby('user').
-        apply(len).
-        to_dict())
+    index = ids.user_index(answers)
+    return index.to_dict(index.counts)
+
+
+def _summary(answers, group_column):
+    if 'session_number' not in answers:
+        answers = decorator.session_number(answers)
+    index = ids.user_index(answers, group_column)
+    inserted = answers['inserted'].values.astype(np.int64)
+    session_numbers = answers['session_number'].values
+    result = pandas.DataFrame({'user': index.users})
+    if group_column is not None:
+        result[group_column] = index.groups
+    result['answers'] = index.counts
+    result['sessions'] = index.max(session_numbers) + 1
+    if 'place_map' in answers:
+        result['maps'] = index.nunique(answers['place_map'].values)
+    result['success'] = index.mean(answers['place_asked'].values == answers['place_answered'].values)
+    result['first_inserted'] = index.reduce(np.minimum, inserted).astype('datetime64[ns]')
+    result['last_inserted'] = index.max(inserted).astype('datetime64[ns]')
+    result['first_session_answers'] = index.sum(session_numbers == 0)
+    return result
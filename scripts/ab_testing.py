@@ -1,12 +1,20 @@
 import matplotlib.pyplot as plt
 import proso.geography.graph as graph
 import proso.geography.analysis as analysis
-import proso.geography.answers as answer
+import proso.geography.cache as cache
 import proso.geography.decorator as decorator
 import proso.geography.abtesting as abtesting
 import proso.geography.textstats as textstats
 
 
+GROUP_COLUMNS = {
+    'motivation': ['place_map'],
+    'progress': [],
+    'text': [],
+    'difference': [],
+}
+
+
 def load_parser():
     parser = analysis.parser_init()
     parser = analysis.parser_group(parser, ['motivation', 'progress', 'text', 'difference'])
@@ -29,15 +37,15 @@ def load_parser():
     return parser
 
 
-def load_answers_to_ab_testing(args):
+def load_answers_to_ab_testing(args, columns=None):
     filename = 'geography.answer.ab_testing_' + '__'.join(args.interested_prefixes) + '__' + analysis.data_hash(args)
-    data = analysis.read_cache(args, filename, csv_parser=answer.from_csv)
+    data = analysis.read_answers_cache(args, filename, columns=columns)
     if data is not None:
         return data
     data, _ = analysis.load_answers(args, all_needed=False)
     data = abtesting.prepare_data(data, args.interested_prefixes)
     analysis.write_cache(args, data, filename)
-    return data
+    return cache.project(data, columns)
 
 
 def map_graphs(args, data, feedback, prior_skill, mapping, prefix, filename_prefix, group_column):
@@ -130,7 +138,10 @@ def main():
 
     prefix = '__'.join(sorted(args.interested_prefixes)) + '_'
 
-    data = load_answers_to_ab_testing(args)
+    columns = analysis.required_columns(
+        args, GROUP_COLUMNS,
+        ['ab_values', 'interested_ab_values'] + (args.split_maps if args.split_maps else []))
+    data = load_answers_to_ab_testing(args, columns=columns)
     data, mapping = decorator.ab_group(data, args.interested_prefixes)
     if args.buckets:
         data, mapping = abtesting.bucketing(data, 'ab_group', mapping, args.buckets)
@@ -162,6 +173,8 @@ def main():
         return
     if args.split_maps:
         for map_name, map_data in data.groupby(args.split_maps):
+            if len(map_data) == 0:
+                continue
             map_prefix = (map_name if isinstance(map_name, str) else '_'.join(map_name)) + '__'
             print "# Processing AB group"
             map_graphs(
@@ -0,0 +1,11 @@
+import proso.geography.analysis as analysis
+
+
+def main():
+    parser = analysis.parser_init(required=['--dataset'])
+    args = parser.parse_args()
+    analysis.convert_dataset(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,28 @@ import proso.geography.analysis as analysis
 import gc
 
 
+GROUP_COLUMNS = {
+    'time': [],
+    'session': [],
+    'recommendation': ['last_in_session', 'rolling_success'],
+    'knowledge': None,
+    'motivation': ['place_map_code', 'place_asked_type'],
+}
+
+
 def main():
     parser = analysis.parser_init()
     parser = analysis.parser_group(parser,
         ['time', 'session', 'recommendation', 'knowledge', 'motivation'])
     args = parser.parse_args()
-    data, data_all = analysis.load_answers(args, all_needed=False)
+    columns = analysis.required_columns(args, GROUP_COLUMNS)
+    data, data_all = analysis.load_answers(args, all_needed=False, columns=columns)
     feedback = analysis.load_feedback(args, data)
     print 'Answers loaded'
     if analysis.is_any_group(args, ['recommendation', 'knowledge', 'motivation']):
         difficulty, prior_skill = analysis.load_difficulty_and_prior_skill(args, data_all)
         if difficulty is None:
-            data, data_all = analysis.load_answers(args, all_needed=True)
+            data, data_all = analysis.load_answers(args, all_needed=True, columns=columns)
             print 'Answers loaded (again)'
             difficulty, prior_skill = analysis.load_difficulty_and_prior_skill(args, data_all)
         print 'Difficulty loaded'
@@ -34,6 +44,7 @@ def main():
     else:
         print "Group [time] skipped"
     if analysis.is_group(args, 'session'):
+        analysis.load_session_summary(args, data)
         fig = plt.figure()
         graph.plot_session_length(fig, data, verbose=args.verbose)
         fig.suptitle('Session length')
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from setuptools import setup
 
+try:
+    from Cython.Build import cythonize
+    ext_modules = cythonize('proso/geography/_elo.pyx')
+except ImportError:
+    ext_modules = []
+
 
 setup(
     name='proso-geography-analysis',
@@ -10,6 +16,8 @@ setup(
     author_email='jan.papousek@gmail.com',
     packages=['proso.geography', 'proso'],
     namespace_packages = ['proso.geography', 'proso'],
+    package_data={'proso.geography': ['*.pyx']},
+    ext_modules=ext_modules,
     license='Gnu GPL v3',
     url='https://github.com/proso/geography-analysis-libs/',
     install_requires=[
@@ -19,7 +27,7 @@ setup(
         'matplotlib>=1.3.1',
         'numpy>=1.8.0',
         'numexpr>=2.4',
-        'pandas>=0.13.1',
+        'pandas>=0.15.2',
         'proso-geography-data>=1.0.2',
         'python-dateutil>=2.2',
         'scipy>=0.14.0',